@@ -1,60 +1,216 @@
 # core/cacher.py
-import pickle
+import hashlib
+import os
+from concurrent.futures import ProcessPoolExecutor
+from typing import Optional, Tuple
+
 import cv2
+import faiss
+import msgpack
 import numpy as np
 
 from logger import logger # Адаптируем под вашу структуру
-from settings import ORB_N_FEATURES
-from core.utils import resize_image
-
-def _keypoints_to_json(keypoints):
-    """Конвертирует список объектов cv2.KeyPoint в сериализуемый формат."""
-    if keypoints is None:
-        return []
-    return [
-        {
-            "pt": kp.pt,
-            "size": kp.size,
-            "angle": kp.angle,
-            "response": kp.response,
-            "octave": kp.octave,
-            "class_id": kp.class_id
-        }
-        for kp in keypoints
-    ]
+from settings import (
+    FAISS_IVF_MIN_DESCRIPTORS, RESIZE_WIDTH, RESIZE_HEIGHT,
+    ORB_N_FEATURES, ORB_N_LEVELS, ORB_EDGE_THRESHOLD, ORB_FAST_THRESHOLD
+)
+from core.utils import load_gray_image, create_orb, extract_features
+
+# Детектор ORB создается один раз в каждом процессе-воркере при первом вызове
+_orb = None
+
+# Сколько путей передается воркеру за одну пересылку (амортизирует накладные расходы IPC)
+_CHUNK_SIZE = 16
+
+# Ширина ORB-дескриптора в байтах (256 бит)
+DESCRIPTOR_WIDTH = 32
+
+# Размер буфера записи файлов кэша
+_WRITE_BUFFER_SIZE = 1 << 20
+
+# Сколько дескрипторов на кластер берется для обучения IndexBinaryIVF
+_IVF_TRAIN_PER_LIST = 64
+
+# Суффикс временных файлов, в которые пишется новый кэш до подмены старого
+_TMP_SUFFIX = '.tmp'
+
+
+def index_file_path(cache_path: str) -> str:
+    """
+    Возвращает путь к файлу бинарного индекса FAISS для данного индекса кэша.
+
+    Кэш состоит из трех файлов: индекса (msgpack) по пути cache_path, индекса
+    FAISS с дескрипторами uint8 (N, 32) рядом с ним, с расширением .faiss, и
+    координат ключевых точек (см. keypoints_file_path).
+    """
+    return os.path.splitext(cache_path)[0] + '.faiss'
+
+
+def keypoints_file_path(cache_path: str) -> str:
+    """
+    Возвращает путь к файлу с координатами ключевых точек для данного индекса кэша.
+
+    Координаты хранятся сырой матрицей float32 (N, 2) в том же порядке строк,
+    что и дескрипторы в индексе FAISS, чтобы ее можно было отобразить в память.
+    """
+    return os.path.splitext(cache_path)[0] + '.kp'
+
+
+def extract_file_features(path: str) -> Tuple[str, Optional[np.ndarray], Optional[np.ndarray]]:
+    """
+    Читает одно изображение и извлекает из него ORB-признаки.
+
+    Функция верхнего уровня, чтобы ее можно было передать в ProcessPoolExecutor
+    (используется и при построении кэша, и для query-изображений в Searcher).
+
+    Returns:
+        Кортеж (путь, массив ключевых точек (N, 7), дескрипторы) или
+        (путь, None, None), если изображение не удалось обработать.
+    """
+    global _orb
+    if _orb is None:
+        # Параллелизм уже обеспечен процессами — внутренние потоки OpenCV
+        # в каждом воркере только создали бы переподписку ядер.
+        cv2.setNumThreads(1)
+        _orb = create_orb()
+
+    try:
+        img = load_gray_image(path)
+        if img is None:
+            return path, None, None
+
+        kp_arr, des = extract_features(_orb, img)
+        return path, kp_arr, des
+    except Exception as e:
+        logger.error("Ошибка при обработке файла %s: %s", path, e)
+        return path, None, None
+
+
+def _build_ivf_index(flat_index: faiss.IndexBinaryFlat) -> faiss.IndexBinaryIVF:
+    """
+    Перестраивает полный бинарный индекс в инвертированный (IndexBinaryIVF).
+
+    Центроиды ~sqrt(N) кластеров обучаются на случайной выборке дескрипторов,
+    после чего в индекс добавляются все дескрипторы в прежнем порядке строк.
+    """
+    xb = faiss.vector_to_array(flat_index.xb).reshape(-1, DESCRIPTOR_WIDTH)
+    nlist = int(np.sqrt(len(xb)))
+    n_train = min(len(xb), _IVF_TRAIN_PER_LIST * nlist)
+    train_sample = xb[np.random.default_rng(0).choice(len(xb), n_train, replace=False)]
+
+    logger.info("Построение IndexBinaryIVF: %d дескрипторов, %d кластеров...", len(xb), nlist)
+    quantizer = faiss.IndexBinaryFlat(DESCRIPTOR_WIDTH * 8)
+    index = faiss.IndexBinaryIVF(quantizer, DESCRIPTOR_WIDTH * 8, nlist)
+    index.train(train_sample)
+    index.add(xb)
+    return index
+
+
+def _inputs_fingerprint(image_paths: list[str]) -> str:
+    """
+    Возвращает отпечаток входных данных кэша: пути, размеры и время изменения
+    файлов, а также параметры извлечения признаков.
+
+    Если отпечаток совпадает с сохраненным в кэше, кэш строить заново не нужно.
+    Отсутствующий файл учитывается как (-1, -1), чтобы его появление тоже меняло отпечаток.
+    """
+    digest = hashlib.blake2b(digest_size=16)
+    digest.update(repr((RESIZE_WIDTH, RESIZE_HEIGHT, ORB_N_FEATURES, ORB_N_LEVELS,
+                        ORB_EDGE_THRESHOLD, ORB_FAST_THRESHOLD, FAISS_IVF_MIN_DESCRIPTORS)).encode())
+    for path in image_paths:
+        try:
+            st = os.stat(path)
+            size, mtime_ns = st.st_size, st.st_mtime_ns
+        except OSError:
+            size, mtime_ns = -1, -1
+        digest.update(f'{path}\0{size}\0{mtime_ns}\n'.encode('utf-8', 'surrogateescape'))
+    return digest.hexdigest()
+
+
+def _read_inputs_fingerprint(cache_path: str) -> Optional[str]:
+    """
+    Возвращает отпечаток входных данных из существующего кэша или None, если
+    кэша (любого из трех файлов) нет или его не удалось прочитать.
+    """
+    if not (os.path.exists(index_file_path(cache_path)) and os.path.exists(keypoints_file_path(cache_path))):
+        return None
+    try:
+        with open(cache_path, 'rb') as f:
+            return msgpack.unpackb(f.read(), raw=False).get('inputs')
+    except (OSError, ValueError, AttributeError, msgpack.UnpackException):
+        return None
+
 
 class DescriptorCacher:
     def __init__(self, image_paths: list[str]):
         self.image_paths = image_paths
-        self.orb = cv2.ORB_create(nfeatures=ORB_N_FEATURES)
 
     def create_and_save_cache(self, cache_path: str):
-        """Извлекает и сохраняет дескрипторы и данные о ключевых точках в кэш."""
+        """
+        Извлекает и сохраняет дескрипторы и данные о ключевых точках в кэш.
+
+        Изображения обрабатываются параллельно пулом процессов (по одному на ядро).
+        Дескрипторы всех изображений добавляются подряд в бинарный индекс FAISS,
+        который сохраняется в файл (см. index_file_path), координаты ключевых точек
+        пишутся подряд в отдельный файл (см. keypoints_file_path), а индекс кэша —
+        пути и число строк на изображение — сохраняется в cache_path в формате msgpack.
+
+        Если файлы изображений и параметры ORB не изменились с прошлого построения
+        (см. _inputs_fingerprint), существующий кэш остается без изменений.
+        """
+        # Если база не изменилась с прошлого построения, кэш остается прежним —
+        # и загруженный ранее Searcher можно использовать повторно (см. get_searcher)
+        inputs = _inputs_fingerprint(self.image_paths)
+        if _read_inputs_fingerprint(cache_path) == inputs:
+            logger.info("Кэш дескрипторов '%s' актуален (%d изображений), пересоздание не требуется.",
+                        cache_path, len(self.image_paths))
+            return
+
         logger.info("Создание кэша дескрипторов для %d изображений...", len(self.image_paths))
-        
-        data_to_cache = {}
-        for i, path in enumerate(self.image_paths):
-            if (i + 1) % 100 == 0:
-                logger.info("Обработано %d/%d изображений...", i + 1, len(self.image_paths))
-
-            try:
-                img = cv2.imread(path, cv2.IMREAD_GRAYSCALE)
-                if img is None: continue
-                
-                img = resize_image(img)
-                kp, des = self.orb.detectAndCompute(img, None)
-                
-                if des is not None and len(des) > 0:
-                    # Сохраняем не сами объекты kp, а их данные
-                    data_to_cache[path] = {
-                        'kp_data': _keypoints_to_json(kp), 
-                        'des': des
-                    }
-            except Exception as e:
-                logger.error("Ошибка при обработке файла %s: %s", path, e)
-
-        logger.info("Кэширование завершено. Сохранение в файл: %s", cache_path)
-        with open(cache_path, 'wb') as f:
-            pickle.dump(data_to_cache, f)
-        
-        logger.info("Кэш успешно сохранен.")
\ No newline at end of file
+
+        # Бинарный индекс FAISS: полный перебор по Хэммингу с SIMD popcount.
+        # Строится один раз здесь, а Searcher только читает его с диска.
+        index = faiss.IndexBinaryFlat(DESCRIPTOR_WIDTH * 8)
+        paths, row_counts = [], []
+        kp_path = keypoints_file_path(cache_path)
+        # Все файлы пишутся во временные и подменяются целиком только после записи
+        kp_tmp_path = kp_path + _TMP_SUFFIX
+        with open(kp_tmp_path, 'wb', buffering=_WRITE_BUFFER_SIZE) as kp_file, \
+                ProcessPoolExecutor(max_workers=os.cpu_count()) as executor:
+            results = executor.map(extract_file_features, self.image_paths, chunksize=_CHUNK_SIZE)
+            for i, (path, kp_arr, des) in enumerate(results):
+                if (i + 1) % 100 == 0:
+                    logger.info("Обработано %d/%d изображений...", i + 1, len(self.image_paths))
+
+                if des is not None:
+                    # Из ключевых точек для поиска нужны только координаты
+                    index.add(np.ascontiguousarray(des, dtype=np.uint8))
+                    kp_file.write(np.ascontiguousarray(kp_arr[:, 0:2], dtype=np.float32).tobytes())
+                    paths.append(path)
+                    row_counts.append(len(des))
+
+        cache_index = {
+            'paths': paths,
+            'row_counts': row_counts,
+            'total_rows': int(sum(row_counts)),
+            'inputs': inputs,
+        }
+
+        # Для большой базы полный перебор слишком дорог — переходим на приближенный поиск
+        if index.ntotal >= FAISS_IVF_MIN_DESCRIPTORS:
+            index = _build_ivf_index(index)
+
+        index_path = index_file_path(cache_path)
+        logger.info("Кэширование завершено. Сохранение в файлы: %s, %s, %s", cache_path, index_path, kp_path)
+        faiss.write_index_binary(index, index_path + _TMP_SUFFIX)
+        with open(cache_path + _TMP_SUFFIX, 'wb', buffering=_WRITE_BUFFER_SIZE) as f:
+            msgpack.pack(cache_index, f, use_bin_type=True)
+
+        # os.replace не обрезает старые файлы на месте: Searcher, уже отобразивший
+        # их в память, видит прежнее содержимое. Индекс кэша (msgpack) подменяется
+        # последним — по времени его изменения get_searcher понимает, что кэш пересоздан.
+        os.replace(kp_tmp_path, kp_path)
+        os.replace(index_path + _TMP_SUFFIX, index_path)
+        os.replace(cache_path + _TMP_SUFFIX, cache_path)
+
+        logger.info("Кэш успешно сохранен.")
@@ -2,140 +2,427 @@
 """
 Модуль для поиска изображений с использованием кэша дескрипторов.
 
-Он загружает предварительно вычисленные дескрипторы и данные о ключевых точках,
-а затем ищет наилучшее совпадение для каждого нового изображения,
-используя Brute-Force сопоставление и геометрическую верификацию RANSAC.
+Он загружает предварительно построенный бинарный индекс FAISS с дескрипторами
+и координаты ключевых точек (отображаются в память через np.memmap), а затем ищет наилучшее совпадение для каждого
+нового изображения: один поиск ближайших соседей по расстоянию Хэмминга, группировка
+совпадений по изображениям и геометрическая верификация RANSAC.
 """
-import pickle
+import functools
 import os
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+
 import cv2
+import faiss
+import msgpack
 import numpy as np
-from typing import Optional, List, Dict, Any
+from typing import List, Optional, Sequence, Tuple
 
 # Импорты адаптированы под вашу структуру, где logger и settings
 # находятся в корне проекта.
 from logger import logger
-from settings import ORB_N_FEATURES, RANSAC_MIN_INLIERS
-from core.utils import resize_image
+from settings import RANSAC_MIN_INLIERS, FAISS_THREADS, FAISS_IVF_NPROBE
+from core.cacher import index_file_path, keypoints_file_path, extract_file_features
+from core.utils import load_gray_image, create_orb, extract_features
+
+# Количество ближайших соседей для каждого query-дескриптора по всей базе.
+# Нужно больше двух, чтобы у одного изображения нашлась пара для фильтра Лоу.
+KNN_NEIGHBOURS = 4
+LOWE_RATIO = 0.75
+
+# Параметры геометрической верификации (USAC_MAGSAC сходится за меньшее число итераций, чем RANSAC)
+HOMOGRAPHY_METHOD = cv2.USAC_MAGSAC
+HOMOGRAPHY_REPROJ_THRESHOLD = 5.0
+HOMOGRAPHY_MAX_ITERS = 2000
+HOMOGRAPHY_CONFIDENCE = 0.995
+
+# Число потоков для параллельной геометрической верификации кандидатов
+VERIFY_WORKERS = os.cpu_count() or 1
+
+# Число процессов для параллельного извлечения признаков query-изображений
+# и сколько путей передается процессу за одну пересылку
+QUERY_EXTRACT_WORKERS = os.cpu_count() or 1
+QUERY_EXTRACT_CHUNK_SIZE = 4
+
+# Сколько наборов признаков query-изображений держать в LRU-кэше.
+# Верхняя граница памяти: QUERY_FEATURES_CACHE_SIZE * ORB_N_FEATURES * (32 + 8) байт
+# (дескриптор 32 байта и координаты x, y в float32 — 8 байт на точку).
+QUERY_FEATURES_CACHE_SIZE = 1024
+
 
-def _json_to_keypoints(kp_data: List[Dict[str, Any]]) -> List[cv2.KeyPoint]:
+def _count_inliers(src_pts: np.ndarray, dst_pts: np.ndarray) -> int:
     """
-    Воссоздает список объектов cv2.KeyPoint из сериализованных данных.
-    
-    Args:
-        kp_data: Список словарей, где каждый словарь описывает один KeyPoint.
+    Оценивает гомографию между наборами точек и возвращает число согласованных точек.
 
-    Returns:
-        Список объектов cv2.KeyPoint.
+    cv2.findHomography отпускает GIL, поэтому функцию можно вызывать из нескольких потоков.
     """
-    if not kp_data:
-        return []
-    
-    keypoints = []
-    for p in kp_data:
-        kp = cv2.KeyPoint(
-            p["pt"][0],      # x
-            p["pt"][1],      # y
-            p["size"],       # size
-            p["angle"],      # angle
-            p["response"],   # response
-            p["octave"],     # octave
-            p["class_id"]    # class_id
-        )
-        keypoints.append(kp)
-    return keypoints
+    _, mask = cv2.findHomography(
+        src_pts, dst_pts,
+        method=HOMOGRAPHY_METHOD,
+        ransacReprojThreshold=HOMOGRAPHY_REPROJ_THRESHOLD,
+        maxIters=HOMOGRAPHY_MAX_ITERS,
+        confidence=HOMOGRAPHY_CONFIDENCE
+    )
+    return 0 if mask is None else int(np.sum(mask))
+
+
+def _keypoint_coords(kp_arr: Optional[np.ndarray]) -> Optional[np.ndarray]:
+    """
+    Оставляет от массива ключевых точек (N, 7) только непрерывные координаты (N, 2).
+
+    Как и в кэше базы, координаты готовятся один раз при извлечении признаков,
+    а не при каждом сопоставлении.
+    """
+    return None if kp_arr is None else np.ascontiguousarray(kp_arr[:, 0:2], dtype=np.float32)
+
 
 class Searcher:
     def __init__(self, cache_path: str):
         """
         Инициализирует искатель, загружая кэш дескрипторов.
 
+        Индекс кэша (пути, число строк на изображение) читается из msgpack,
+        бинарный индекс FAISS с дескрипторами — из соседнего файла, построенного
+        DescriptorCacher, поэтому заново его не строят. Координаты ключевых точек
+        отображаются в память только для чтения: при поиске ОС подгружает лишь
+        страницы с нужными строками.
+
         Args:
-            cache_path (str): Путь к файлу кэша (*.pkl).
+            cache_path (str): Путь к индексу кэша (*.msgpack).
         """
         logger.info("Загрузка кэша дескрипторов из '%s'...", cache_path)
         with open(cache_path, 'rb') as f:
-            self.cached_data = pickle.load(f)
-        
-        self.orb = cv2.ORB_create(nfeatures=ORB_N_FEATURES)
-        self.matcher = cv2.BFMatcher(cv2.NORM_HAMMING)
-        logger.info("Кэш загружен. Найдено %d изображений в базе. Готов к поиску.", len(self.cached_data))
+            cache_index = msgpack.unpackb(f.read(), raw=False)
+
+        # Все дескрипторы базы лежат в индексе одной матрицей (sum_N, 32);
+        # запоминаем, какой строке какое изображение соответствует.
+        self.paths = cache_index['paths']
+        # Имена файлов для логов вычисляются один раз, а не при каждом совпадении
+        self.names = [os.path.basename(path) for path in self.paths]
+        row_counts = cache_index['row_counts']
+        total_rows = cache_index['total_rows']
+        self.row_to_image = np.repeat(np.arange(len(self.paths)), row_counts)
+
+        # Координаты ключевых точек в том же порядке строк, что и в индексе
+        if total_rows:
+            self.all_kp_xy = np.memmap(keypoints_file_path(cache_path), dtype=np.float32,
+                                       mode='r', shape=(total_rows, 2))
+        else:
+            self.all_kp_xy = np.empty((0, 2), dtype=np.float32)
+
+        # Явно задаем число потоков поиска, чтобы не зависеть от умолчаний OpenMP
+        faiss.omp_set_num_threads(FAISS_THREADS)
+        self.index = faiss.read_index_binary(index_file_path(cache_path))
+        if isinstance(self.index, faiss.IndexBinaryIVF):
+            # Для большой базы кэш содержит инвертированный индекс (см. DescriptorCacher)
+            self.index.nprobe = FAISS_IVF_NPROBE
+        if self.index.ntotal != total_rows:
+            raise ValueError(f"Индекс FAISS содержит {self.index.ntotal} дескрипторов, "
+                             f"а индекс кэша — {total_rows}")
+
+        self.orb = create_orb()
+        # Пул потоков живет вместе с искателем, чтобы не создавать его на каждый запрос
+        self._verify_executor = ThreadPoolExecutor(max_workers=VERIFY_WORKERS)
+        # LRU-кэш признаков query-изображений: (путь, mtime_ns) -> (kp_xy, des)
+        self._query_features: "OrderedDict[Tuple[str, int], Tuple[np.ndarray, np.ndarray]]" = OrderedDict()
+        # Переиспользуемые буферы координат совпадений (растут по мере надобности)
+        self._src_buf = np.empty((0, 2), dtype=np.float32)
+        self._dst_buf = np.empty((0, 2), dtype=np.float32)
+        logger.info("Кэш загружен. Найдено %d изображений в базе. Готов к поиску.", len(self.paths))
+
+    def _ratio_test(self, D: np.ndarray, I: np.ndarray) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+        """
+        Векторизованный фильтр Лоу, применяемый отдельно для каждого изображения базы.
+
+        Соседи в строке отсортированы по расстоянию, поэтому первое вхождение
+        изображения — его лучший сосед, а следующее вхождение того же изображения —
+        второй по близости. Если второго вхождения в строке нет, реальный второй
+        сосед не ближе последнего соседа в строке, и его расстояние служит оценкой.
+
+        Args:
+            D: Расстояния Хэмминга формы (Q, k).
+            I: Номера строк общей матрицы дескрипторов формы (Q, k), -1 — нет соседа.
+
+        Returns:
+            Кортеж массивов (номер query-дескриптора, строка в общей матрице,
+            номер изображения) для всех прошедших фильтр совпадений.
+        """
+        n_queries, k = I.shape
+        valid = I >= 0
+        image_of = np.where(valid, self.row_to_image[np.where(valid, I, 0)], -1)
+        dists = D.astype(np.float32)
+
+        last = valid.sum(axis=1) - 1
+        bound = dists[np.arange(n_queries), np.maximum(last, 0)]
+
+        query_parts, row_parts = [], []
+        for j in range(k):
+            # Первое ли это вхождение изображения в строке?
+            first = valid[:, j].copy()
+            for i in range(j):
+                first &= image_of[:, i] != image_of[:, j]
+
+            # Расстояние до второго соседа из того же изображения (ближайшее следующее вхождение)
+            second = bound.copy()
+            for i in range(k - 1, j, -1):
+                same = valid[:, i] & (image_of[:, i] == image_of[:, j])
+                second = np.where(same, dists[:, i], second)
+
+            passed = np.nonzero(first & (dists[:, j] < LOWE_RATIO * second))[0]
+            query_parts.append(passed)
+            row_parts.append(I[passed, j])
+
+        query_idx = np.concatenate(query_parts)
+        train_rows = np.concatenate(row_parts).astype(np.int64)
+        return query_idx, train_rows, self.row_to_image[train_rows]
+
+    @staticmethod
+    def _features_cache_key(query_image_path: str) -> Optional[Tuple[str, int]]:
+        """Ключ LRU-кэша признаков: путь и время модификации файла (None, если файла нет)."""
+        try:
+            return query_image_path, os.stat(query_image_path).st_mtime_ns
+        except OSError:
+            return None
+
+    def _cached_features(self, cache_key: Optional[Tuple[str, int]]) -> Optional[Tuple[np.ndarray, np.ndarray]]:
+        """Возвращает признаки из LRU-кэша или None, если их там нет."""
+        if cache_key is None or cache_key not in self._query_features:
+            return None
+        self._query_features.move_to_end(cache_key)
+        return self._query_features[cache_key]
+
+    def _remember_features(self, cache_key: Optional[Tuple[str, int]],
+                           kp_xy: Optional[np.ndarray], des: Optional[np.ndarray]):
+        """Кладет признаки в LRU-кэш. Изображения без дескрипторов не кэшируются."""
+        if des is None or cache_key is None:
+            return
+        self._query_features[cache_key] = (kp_xy, des)
+        if len(self._query_features) > QUERY_FEATURES_CACHE_SIZE:
+            self._query_features.popitem(last=False)
+
+    def _get_query_features(self, query_image_path: str) -> Tuple[Optional[np.ndarray], Optional[np.ndarray]]:
+        """
+        Возвращает (kp_xy, des) для query-изображения, используя LRU-кэш.
+
+        Ключ кэша — путь и время модификации файла, поэтому измененный файл
+        обрабатывается заново. Изображения без дескрипторов не кэшируются.
+        """
+        cache_key = self._features_cache_key(query_image_path)
+        cached = self._cached_features(cache_key)
+        if cached is not None:
+            return cached
+
+        query_img_gray = load_gray_image(query_image_path)
+        if query_img_gray is None:
+            logger.warning("Не удалось прочитать query-изображение: %s", query_image_path)
+            return None, None
+
+        kp_arr, des = extract_features(self.orb, query_img_gray)
+        kp_xy = _keypoint_coords(kp_arr)
+        self._remember_features(cache_key, kp_xy, des)
+        return kp_xy, des
+
+    def _extract_queries_parallel(self, query_image_paths: Sequence[str]
+                                  ) -> List[Tuple[Optional[np.ndarray], Optional[np.ndarray]]]:
+        """
+        Извлекает признаки нескольких query-изображений в пуле процессов.
+
+        Изображения из LRU-кэша не пересчитываются; остальные читаются и
+        обрабатываются процессами-воркерами (та же функция, что и при построении
+        кэша), так что извлечение ORB не упирается в один поток интерпретатора.
+
+        Returns:
+            Список (kp_xy, des) в порядке query_image_paths; (None, None) для
+            изображений, из которых не удалось получить дескрипторы.
+        """
+        cache_keys = [self._features_cache_key(path) for path in query_image_paths]
+        features = [self._cached_features(cache_key) for cache_key in cache_keys]
+        misses = [i for i, cached in enumerate(features) if cached is None]
+
+        # Для одного изображения запуск пула процессов дороже самого извлечения
+        if len(misses) <= 1:
+            for i in misses:
+                features[i] = self._extract_query(query_image_paths[i])
+            return features
+
+        with ProcessPoolExecutor(max_workers=min(QUERY_EXTRACT_WORKERS, len(misses))) as executor:
+            extracted = executor.map(extract_file_features, [query_image_paths[i] for i in misses],
+                                     chunksize=QUERY_EXTRACT_CHUNK_SIZE)
+            for i, (path, kp_arr, des) in zip(misses, extracted):
+                if des is None:
+                    logger.warning("Не удалось найти дескрипторы в query-изображении: %s", path)
+                kp_xy = _keypoint_coords(kp_arr)
+                self._remember_features(cache_keys[i], kp_xy, des)
+                features[i] = (kp_xy, des)
+        return features
+
+    def _gather_points(self, kp_xy: np.ndarray, query_idx: np.ndarray,
+                       train_rows: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        Собирает координаты совпавших точек в переиспользуемые буферы.
+
+        Буферы выделяются один раз и увеличиваются только при необходимости,
+        поэтому на каждый запрос не создаются новые массивы.
+
+        Returns:
+            Представления (src, dst) формы (n, 1, 2) — действительны до следующего вызова.
+        """
+        n = len(query_idx)
+        if len(self._src_buf) < n:
+            capacity = max(n, 2 * len(self._src_buf))
+            self._src_buf = np.empty((capacity, 2), dtype=np.float32)
+            self._dst_buf = np.empty((capacity, 2), dtype=np.float32)
+
+        src, dst = self._src_buf[:n], self._dst_buf[:n]
+        np.take(kp_xy, query_idx, axis=0, out=src)
+        np.take(self.all_kp_xy, train_rows, axis=0, out=dst)
+        return src.reshape(-1, 1, 2), dst.reshape(-1, 1, 2)
+
+    def _extract_query(self, query_image_path: str) -> Tuple[Optional[np.ndarray], Optional[np.ndarray]]:
+        """
+        Извлекает признаки query-изображения, записывая в лог причину неудачи.
+
+        Returns:
+            Кортеж (kp_xy, des) или (None, None), если дескрипторы получить не удалось.
+        """
+        try:
+            kp_xy, des = self._get_query_features(query_image_path)
+            if des is None:
+                logger.warning("Не удалось найти дескрипторы в query-изображении: %s", query_image_path)
+            return kp_xy, des
+        except Exception as e:
+            logger.error("Ошибка при обработке query-изображения %s: %s", query_image_path, e)
+            return None, None
+
+    def _best_candidate(self, kp1_xy: np.ndarray, D: np.ndarray, I: np.ndarray) -> Optional[str]:
+        """
+        Выбирает лучшее изображение базы по результатам поиска соседей для одного query-изображения.
+
+        Args:
+            kp1_xy: Координаты ключевых точек query-изображения формы (N, 2).
+            D: Расстояния Хэмминга формы (N, k).
+            I: Номера строк общей матрицы дескрипторов формы (N, k).
+
+        Returns:
+            Путь к изображению с наибольшим числом согласованных точек или None.
+        """
+        # Фильтр Лоу отдельно для каждого изображения базы
+        query_idx, train_rows, image_ids = self._ratio_test(D, I)
+
+        best_image_id = None
+        max_inliers = -1
+
+        # Координаты точек для всех совпадений собираем одной выборкой и
+        # группируем по изображениям стабильной сортировкой.
+        order = np.argsort(image_ids, kind='stable')
+        image_ids = image_ids[order]
+        src_all, dst_all = self._gather_points(kp1_xy, query_idx[order], train_rows[order])
+        counts = np.bincount(image_ids, minlength=len(self.paths))
+        starts = np.concatenate(([0], np.cumsum(counts)[:-1]))
+
+        # Геометрическая верификация только для изображений с достаточным числом кандидатов.
+        # Число inliers не превышает числа хороших совпадений, поэтому кандидаты
+        # перебираются по убыванию этого числа пачками по VERIFY_WORKERS (каждая пачка
+        # проверяется параллельно), и как только оно не больше текущего лучшего
+        # результата, остальные изображения заведомо не выиграют.
+        candidates = np.nonzero(counts >= RANSAC_MIN_INLIERS)[0]
+        candidates = candidates[np.argsort(-counts[candidates], kind='stable')]
+        for batch_start in range(0, len(candidates), VERIFY_WORKERS):
+            batch = [image_id for image_id in candidates[batch_start:batch_start + VERIFY_WORKERS]
+                     if counts[image_id] > max_inliers]
+            if not batch:
+                break
+
+            slices = [slice(starts[image_id], starts[image_id] + counts[image_id]) for image_id in batch]
+            inliers = self._verify_executor.map(lambda sl: _count_inliers(src_all[sl], dst_all[sl]), slices)
+
+            # Обновляем лучшего кандидата, если текущий результат лучше
+            for image_id, num_inliers in zip(batch, inliers):
+                if num_inliers >= RANSAC_MIN_INLIERS and num_inliers > max_inliers:
+                    max_inliers = num_inliers
+                    best_image_id = image_id
+
+        if best_image_id is None:
+            return None
+
+        logger.info("Найден лучший кандидат: '%s' с %d согласованными точками.", 
+                    self.names[best_image_id], max_inliers)
+        return self.paths[best_image_id]
 
     def find_match(self, query_image_path: str) -> Optional[str]:
         """
         Ищет наилучшее совпадение для query-изображения в кэше.
 
-        Проходит по всем изображениям в кэше, находит то, у которого
+        Сопоставляет query-дескрипторы со всей базой за один поиск в индексе FAISS,
+        применяет фильтр Лоу отдельно для каждого изображения, находит то, у которого
         наибольшее количество геометрически согласованных точек, и возвращает путь к нему.
 
+        Args:
+            query_image_path (str): Путь к query-изображению.
+
         Returns:
             Путь к найденному изображению или None, если совпадение не найдено.
         """
         # 1. Извлекаем дескрипторы из изображения, которое ищем (query image)
-        try:
-            query_img_gray = cv2.imread(query_image_path, cv2.IMREAD_GRAYSCALE)
-            if query_img_gray is None: 
-                logger.warning("Не удалось прочитать query-изображение: %s", query_image_path)
-                return None
-            
-            query_img_gray = resize_image(query_img_gray)
-            kp1, des1 = self.orb.detectAndCompute(query_img_gray, None)
-
-            if des1 is None or len(kp1) == 0:
-                logger.warning("Не удалось найти дескрипторы в query-изображении: %s", query_image_path)
-                return None
-        except Exception as e:
-            logger.error("Ошибка при обработке query-изображения %s: %s", query_image_path, e)
+        kp1_xy, des1 = self._extract_query(query_image_path)
+        if des1 is None or self.index.ntotal == 0:
             return None
 
-        best_candidate_path = None
-        max_inliers = -1
+        # 2. Один поиск ближайших соседей против всей базы сразу.
+        # D — расстояния Хэмминга, I — номера строк в общей матрице (-1, если соседа нет).
+        k = min(KNN_NEIGHBOURS, self.index.ntotal)
+        D, I = self.index.search(np.ascontiguousarray(des1), k)
+
+        # 3. Фильтр Лоу, группировка по изображениям и геометрическая верификация
+        return self._best_candidate(kp1_xy, D, I)
+
+    def find_matches_batch(self, query_image_paths: Sequence[str]) -> List[Optional[str]]:
+        """
+        Ищет совпадения сразу для нескольких query-изображений.
+
+        Дескрипторы всех изображений складываются в одну матрицу, и поиск соседей
+        выполняется одним вызовом FAISS; затем результаты раскладываются обратно
+        по изображениям и обрабатываются так же, как в find_match.
+
+        Args:
+            query_image_paths: Пути к query-изображениям. Изображения читаются и
+                обрабатываются параллельно в пуле процессов (см. _extract_queries_parallel).
 
-        # 2. Итерируемся по всем кэшированным изображениям
-        for path, data in self.cached_data.items():
-            # Воссоздаем объекты KeyPoint "на лету" из данных кэша
-            kp2 = _json_to_keypoints(data['kp_data'])
-            des2 = data['des']
-            
-            if not kp2 or des2 is None:
-                continue
-
-            # 3. Быстрое сопоставление с помощью Brute-Force и knn
-            try:
-                matches = self.matcher.knnMatch(des1, des2, k=2)
-            except cv2.error as e:
-                logger.debug("Ошибка knnMatch для %s: %s. Пропускаем.", os.path.basename(path), e)
-                continue
-
-            # 4. Фильтр Лоу для отбора "хороших" кандидатов
-            good_matches = []
-            for m, n in matches:
-                # Убеждаемся, что есть два соседа для сравнения
-                if m and n and m.distance < 0.75 * n.distance:
-                    good_matches.append(m)
-
-            # 5. Ранний выход, если кандидатов заведомо мало
-            if len(good_matches) < RANSAC_MIN_INLIERS:
-                continue
-
-            # 6. Геометрическая верификация (RANSAC)
-            src_pts = np.float32([kp1[m.queryIdx].pt for m in good_matches]).reshape(-1, 1, 2)
-            dst_pts = np.float32([kp2[m.trainIdx].pt for m in good_matches]).reshape(-1, 1, 2)
-            
-            _, mask = cv2.findHomography(src_pts, dst_pts, cv2.RANSAC, 5.0)
-            
-            if mask is None:
-                continue
-            
-            num_inliers = np.sum(mask)
-
-            # 7. Обновляем лучшего кандидата, если текущий результат лучше
-            if num_inliers >= RANSAC_MIN_INLIERS and num_inliers > max_inliers:
-                max_inliers = num_inliers
-                best_candidate_path = path
-        
-        if best_candidate_path:
-            logger.info("Найден лучший кандидат: '%s' с %d согласованными точками.", 
-                        os.path.basename(best_candidate_path), max_inliers)
-
-        return best_candidate_path
+        Returns:
+            Список путей к найденным изображениям (None, если совпадение не найдено)
+            в порядке query_image_paths.
+        """
+        features = self._extract_queries_parallel(query_image_paths)
+        results: List[Optional[str]] = [None] * len(query_image_paths)
+
+        with_des = [i for i, (_, des) in enumerate(features) if des is not None]
+        if not with_des or self.index.ntotal == 0:
+            return results
+
+        # Строки общей матрицы запросов, принадлежащие каждому изображению
+        offsets = np.cumsum([0] + [len(features[i][1]) for i in with_des])
+        xq = np.ascontiguousarray(np.vstack([features[i][1] for i in with_des]))
+
+        k = min(KNN_NEIGHBOURS, self.index.ntotal)
+        D, I = self.index.search(xq, k)
+
+        for n, i in enumerate(with_des):
+            rows = slice(offsets[n], offsets[n + 1])
+            results[i] = self._best_candidate(features[i][0], D[rows], I[rows])
+        return results
+
+
+@functools.lru_cache(maxsize=1)
+def _cached_searcher(cache_path: str, mtime_ns: int) -> Searcher:
+    return Searcher(cache_path)
+
+
+def get_searcher(cache_path: str) -> Searcher:
+    """
+    Возвращает Searcher для кэша, переиспользуя уже загруженный в этом процессе.
+
+    Ключ — путь и время модификации индекса кэша (он записывается последним),
+    поэтому после пересоздания кэша загружается новый Searcher. Хранится только
+    последний экземпляр, чтобы устаревший индекс не занимал память.
+    """
+    return _cached_searcher(cache_path, os.stat(cache_path).st_mtime_ns)
@@ -4,54 +4,139 @@
 
 Содержит функции общего назначения, которые используются в разных частях
 основной логики. Включает в себя:
-- Валидацию файлов изображений (проверка на существование, тип и целостность).
-- Функции для изменения размера изображений.
+- Валидацию файлов изображений (проверка на существование, тип, сигнатуру и
+  структуру файла) с кэшированием результатов на диске, в том числе пакетную
+  в пуле потоков.
+- Функции для чтения и изменения размера изображений.
+- Создание детектора ORB и извлечение признаков с удалением дублирующихся точек.
+- Упаковку ключевых точек в компактный массив NumPy.
 - Комплексную функцию для загрузки и предобработки пары изображений для сравнения.
 """
+import io
 import os
-from typing import Tuple, Optional
+import sqlite3
+import stat
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from typing import List, Sequence, Tuple, Optional, Union
 
 import cv2
 import numpy as np
 from PIL import Image, UnidentifiedImageError
 
 from logger import logger
-from settings import RESIZE_WIDTH, RESIZE_HEIGHT
+from settings import (
+    RESIZE_WIDTH, RESIZE_HEIGHT, VALIDATION_CACHE_PATH, VALIDATION_WORKERS,
+    ORB_N_FEATURES, ORB_N_LEVELS, ORB_EDGE_THRESHOLD, ORB_FAST_THRESHOLD
+)
 
 # Определяем поддерживаемые расширения на уровне модуля для переиспользования
 SUPPORTED_EXTENSIONS = ('.png', '.jpg', '.jpeg', '.bmp', '.gif', '.tiff', '.webp')
 
 
-def validate_image_file(file_path: str) -> bool:
+# Для JPEG libjpeg умеет декодировать сразу в 1/2, 1/4 и 1/8 размера (масштабирование
+# на уровне DCT), что заметно быстрее полного декодирования с последующим ресайзом.
+_JPEG_EXTENSIONS = ('.jpg', '.jpeg')
+_REDUCED_GRAYSCALE_MODES = (
+    (8, cv2.IMREAD_REDUCED_GRAYSCALE_8),
+    (4, cv2.IMREAD_REDUCED_GRAYSCALE_4),
+    (2, cv2.IMREAD_REDUCED_GRAYSCALE_2),
+)
+
+# Сигнатуры (magic bytes) поддерживаемых форматов в начале файла
+_IMAGE_SIGNATURES = (
+    b'\xff\xd8\xff',        # JPEG
+    b'\x89PNG\r\n\x1a\n',   # PNG
+    b'GIF87a', b'GIF89a',    # GIF
+    b'BM',                   # BMP
+    b'II*\x00', b'MM\x00*',  # TIFF (little/big endian)
+)
+_SIGNATURE_READ_SIZE = 16
+
+# Сколько путей проверяет одна задача пула валидации (не больше)
+_VALIDATION_CHUNK_SIZE = 32
+
+
+class _ValidationCache:
     """
-    Проверяет, является ли файл действительным и неповрежденным изображением.
+    Дисковый кэш результатов проверки целостности изображений (SQLite).
 
-    1. Проверяет, что путь существует и является файлом.
-    2. Проверяет расширение файла по белому списку.
-    3. Пытается открыть и загрузить данные изображения, чтобы убедиться в его целостности.
+    Запись привязана к пути и к (st_ino, st_mtime_ns, st_size) файла: если файл
+    изменился, запись считается устаревшей и проверка выполняется заново.
+    Кэш вспомогательный — при любой ошибке SQLite он просто отключается.
+    """
 
-    Args:
-        file_path (str): Путь к файлу для проверки.
+    def __init__(self, db_path: str):
+        self.db_path = db_path
+        self._conn: Optional[sqlite3.Connection] = None
+        self._lock = threading.Lock()
+        self._disabled = False
 
-    Returns:
-        bool: True, если файл является валидным изображением, иначе False.
+    def _connection(self) -> Optional[sqlite3.Connection]:
+        if self._conn is None and not self._disabled:
+            try:
+                conn = sqlite3.connect(self.db_path, isolation_level=None, check_same_thread=False)
+                # Кэш можно пересоздать в любой момент, поэтому надежность записи не нужна
+                conn.execute("PRAGMA journal_mode=WAL")
+                conn.execute("PRAGMA synchronous=OFF")
+                conn.execute(
+                    "CREATE TABLE IF NOT EXISTS validation ("
+                    "path TEXT PRIMARY KEY, ino INTEGER, mtime_ns INTEGER, size INTEGER, ok INTEGER)"
+                )
+                self._conn = conn
+            except sqlite3.Error as e:
+                logger.warning("Кэш валидации '%s' недоступен: %s", self.db_path, e)
+                self._disabled = True
+        return self._conn
+
+    def get(self, file_path: str, st: os.stat_result) -> Optional[bool]:
+        """Возвращает сохраненный результат проверки или None, если его нет или он устарел."""
+        with self._lock:
+            conn = self._connection()
+            if conn is None:
+                return None
+            try:
+                row = conn.execute(
+                    "SELECT ok FROM validation WHERE path = ? AND ino = ? AND mtime_ns = ? AND size = ?",
+                    (file_path, st.st_ino, st.st_mtime_ns, st.st_size)
+                ).fetchone()
+            except sqlite3.Error as e:
+                logger.debug("Ошибка чтения кэша валидации: %s", e)
+                return None
+        return None if row is None else bool(row[0])
+
+    def put(self, file_path: str, st: os.stat_result, ok: bool):
+        """Сохраняет результат проверки для текущего состояния файла."""
+        with self._lock:
+            conn = self._connection()
+            if conn is None:
+                return
+            try:
+                conn.execute(
+                    "INSERT OR REPLACE INTO validation (path, ino, mtime_ns, size, ok) VALUES (?, ?, ?, ?, ?)",
+                    (file_path, st.st_ino, st.st_mtime_ns, st.st_size, int(ok))
+                )
+            except sqlite3.Error as e:
+                logger.debug("Ошибка записи в кэш валидации: %s", e)
+
+
+_validation_cache = _ValidationCache(VALIDATION_CACHE_PATH)
+
+
+def _check_image_integrity(file_path: str) -> bool:
     """
-    # 1. Проверка существования пути
-    if not os.path.isfile(file_path):
-        logger.debug("Путь не является файлом или не существует: %s", file_path)
-        return False
-        
-    # 2. Проверка расширения
-    if not file_path.lower().endswith(SUPPORTED_EXTENSIONS):
-        logger.debug("Файл '%s' пропущен из-за неподдерживаемого расширения.", os.path.basename(file_path))
-        return False
+    Проверяет структуру файла изображения средствами Pillow без декодирования пикселей.
 
-    # 3. Проверка целостности (самая надежная)
+    Image.verify() читает заголовки и структуру файла (для PNG — в том числе
+    контрольные суммы блоков), но не выполняет полного декодирования. Часть
+    повреждений в середине данных при этом может пройти проверку — такие файлы
+    отсеются позже, когда cv2.imread вернет None (этот случай уже обрабатывается
+    при построении кэша и при поиске).
+    """
     try:
         # Используем Pillow, так как он отлично справляется с определением целостности
         with Image.open(file_path) as img:
-            img.load()  # Попытка загрузить данные изображения в память.
-                        # Вызовет исключение для битых или неполных файлов.
+            img.verify()  # Вызовет исключение для битых файлов, не декодируя пиксели.
         logger.debug("Изображение валидно: %s", file_path)
         return True
     except UnidentifiedImageError:
@@ -62,6 +147,112 @@ def validate_image_file(file_path: str) -> bool:
         return False
 
 
+def _has_image_signature(file_path: str) -> bool:
+    """
+    Проверяет сигнатуру формата по первым байтам файла (без разбора структуры).
+    """
+    try:
+        with open(file_path, 'rb') as f:
+            head = f.read(_SIGNATURE_READ_SIZE)
+    except OSError as e:
+        logger.warning("Файл не может быть прочитан: %s. Ошибка: %s", os.path.basename(file_path), e)
+        return False
+
+    if head.startswith(_IMAGE_SIGNATURES) or (head[:4] == b'RIFF' and head[8:12] == b'WEBP'):
+        return True
+    logger.warning("Не удалось идентифицировать как изображение (неверный формат): %s", os.path.basename(file_path))
+    return False
+
+
+def validate_image_file(file_path: Union[str, os.DirEntry], deep: bool = False) -> bool:
+    """
+    Проверяет, является ли файл действительным и неповрежденным изображением.
+
+    1. Проверяет расширение файла по белому списку (без обращения к диску).
+    2. Проверяет, что путь существует и является файлом.
+    3. Проверяет сигнатуру формата по первым байтам файла.
+    4. Если deep=True — проверяет структуру файла без полного декодирования
+       (см. _check_image_integrity). Результат кэшируется на диске
+       (VALIDATION_CACHE_PATH), поэтому при повторных запусках неизменившиеся
+       файлы не открываются — достаточно одного os.stat.
+
+    Без глубокой проверки поврежденный в середине файл может пройти валидацию —
+    он отсеется позже, когда cv2.imread вернет None.
+
+    Args:
+        file_path (str | os.DirEntry): Путь к файлу или запись os.scandir. Для
+            DirEntry тип файла берется из данных каталога, а stat — из кэша записи.
+        deep (bool): Выполнять ли проверку структуры файла средствами Pillow.
+
+    Returns:
+        bool: True, если файл является валидным изображением, иначе False.
+    """
+    entry = None
+    if isinstance(file_path, os.DirEntry):
+        entry, file_path = file_path, file_path.path
+
+    # 1. Проверка расширения — без системных вызовов, поэтому первой
+    if not file_path.lower().endswith(SUPPORTED_EXTENSIONS):
+        logger.debug("Файл '%s' пропущен из-за неподдерживаемого расширения.", os.path.basename(file_path))
+        return False
+
+    # 2. Проверка существования пути (один stat; файл открывается только после него)
+    try:
+        if entry is None:
+            st = os.stat(file_path)
+        else:
+            # DirEntry кэширует результат stat, повторные обращения не делают системных вызовов
+            st = entry.stat() if entry.is_file() else None
+    except OSError:
+        st = None
+    if st is None or not stat.S_ISREG(st.st_mode):
+        logger.debug("Путь не является файлом или не существует: %s", file_path)
+        return False
+
+    # При глубокой проверке сначала смотрим кэш: вердикт для неизменившегося
+    # файла уже учитывает и сигнатуру, и структуру — файл можно не открывать
+    if deep:
+        cached = _validation_cache.get(file_path, st)
+        if cached is not None:
+            return cached
+
+    # 3. Быстрая проверка сигнатуры формата
+    if not _has_image_signature(file_path):
+        return False
+    if not deep:
+        return True
+
+    # 4. Проверка целостности (самая надежная), результат кэшируется
+    is_valid = _check_image_integrity(file_path)
+    _validation_cache.put(file_path, st, is_valid)
+    return is_valid
+
+
+def validate_image_files(items: Sequence[Union[str, os.DirEntry]], deep: bool = False) -> List[bool]:
+    """
+    Проверяет файлы через validate_image_file параллельно в пуле потоков.
+
+    Проверка упирается в ввод-вывод (stat, чтение заголовков), поэтому потоки
+    позволяют перекрыть задержки диска.
+
+    Returns:
+        List[bool]: Результаты проверки в порядке items.
+    """
+    if not items:
+        return []
+
+    # ThreadPoolExecutor.map игнорирует chunksize, поэтому пути группируются
+    # вручную: одна задача пула проверяет целую пачку, а не один файл
+    def validate_chunk(chunk: Sequence[Union[str, os.DirEntry]]) -> List[bool]:
+        return [validate_image_file(item, deep=deep) for item in chunk]
+
+    # Короткие списки делятся мельче, чтобы работа все равно распределилась по потокам
+    chunk_size = max(1, min(_VALIDATION_CHUNK_SIZE, -(-len(items) // VALIDATION_WORKERS)))
+    chunks = [items[i:i + chunk_size] for i in range(0, len(items), chunk_size)]
+    with ThreadPoolExecutor(max_workers=min(VALIDATION_WORKERS, len(chunks))) as executor:
+        return [flag for chunk_flags in executor.map(validate_chunk, chunks) for flag in chunk_flags]
+
+
 def resize_image(image: np.ndarray) -> np.ndarray:
     """
     Изменяет размер OpenCV изображения до стандартных размеров проекта.
@@ -75,6 +266,134 @@ def resize_image(image: np.ndarray) -> np.ndarray:
     return cv2.resize(image, (RESIZE_WIDTH, RESIZE_HEIGHT), interpolation=cv2.INTER_AREA)
 
 
+def _pick_gray_read_mode(file_path: str, data: bytes) -> int:
+    """
+    Выбирает флаг cv2.imdecode для чтения в градациях серого.
+
+    Для JPEG берется наибольший коэффициент уменьшения, при котором изображение
+    все еще не меньше стандартного размера проекта, поэтому качество после
+    resize_image не страдает. Размеры читаются из заголовка уже прочитанных
+    байтов файла, без декодирования.
+    """
+    if not file_path.lower().endswith(_JPEG_EXTENSIONS):
+        return cv2.IMREAD_GRAYSCALE
+    try:
+        with Image.open(io.BytesIO(data)) as img:
+            width, height = img.size
+    except (IOError, OSError):
+        return cv2.IMREAD_GRAYSCALE
+
+    for factor, mode in _REDUCED_GRAYSCALE_MODES:
+        if width // factor >= RESIZE_WIDTH and height // factor >= RESIZE_HEIGHT:
+            return mode
+    return cv2.IMREAD_GRAYSCALE
+
+
+def load_gray_image(file_path: str) -> Optional[np.ndarray]:
+    """
+    Читает изображение в градациях серого и приводит его к стандартному размеру.
+
+    Файл читается с диска один раз: по этим же байтам определяется размер
+    (заголовок) и выполняется декодирование. Большие JPEG декодируются сразу
+    в уменьшенном виде (см. _pick_gray_read_mode).
+
+    Args:
+        file_path (str): Путь к изображению.
+
+    Returns:
+        np.ndarray или None, если изображение не удалось прочитать.
+    """
+    try:
+        with open(file_path, 'rb') as f:
+            data = f.read()
+        img = cv2.imdecode(np.frombuffer(data, dtype=np.uint8), _pick_gray_read_mode(file_path, data))
+        if img is None:
+            return None
+        return resize_image(img)
+    except Exception as e:
+        logger.error("Ошибка при чтении изображения %s: %s", file_path, e)
+        return None
+
+
+def keypoints_to_array(keypoints) -> np.ndarray:
+    """
+    Упаковывает список объектов cv2.KeyPoint в один массив float32 формы (N, 7).
+
+    Колонки: x, y, size, angle, response, octave, class_id. Первые две колонки
+    (координаты) используются напрямую при построении точек для RANSAC.
+
+    Args:
+        keypoints: Список (или кортеж) объектов cv2.KeyPoint.
+
+    Returns:
+        np.ndarray: Массив float32 формы (N, 7).
+    """
+    if not keypoints:
+        return np.empty((0, 7), dtype=np.float32)
+    return np.array(
+        [(kp.pt[0], kp.pt[1], kp.size, kp.angle, kp.response, kp.octave, kp.class_id) for kp in keypoints],
+        dtype=np.float32
+    )
+
+
+def create_orb() -> cv2.ORB:
+    """
+    Создает детектор ORB с параметрами проекта.
+
+    Используется и при построении кэша, и при поиске, чтобы признаки были совместимы.
+    """
+    return cv2.ORB_create(
+        nfeatures=ORB_N_FEATURES,
+        nlevels=ORB_N_LEVELS,
+        edgeThreshold=ORB_EDGE_THRESHOLD,
+        fastThreshold=ORB_FAST_THRESHOLD,
+        WTA_K=2,
+        patchSize=31
+    )
+
+
+def _remove_duplicate_keypoints(keypoints) -> list:
+    """
+    Убирает ключевые точки, найденные в одном и том же пикселе на разных уровнях пирамиды.
+
+    Из каждой группы остается точка с наибольшим откликом (response).
+    """
+    if len(keypoints) < 2:
+        return list(keypoints)
+    coords = np.array([kp.pt for kp in keypoints], dtype=np.float32)
+    responses = np.array([kp.response for kp in keypoints], dtype=np.float32)
+
+    order = np.argsort(-responses, kind='stable')
+    pixels = np.round(coords[order]).astype(np.int32)
+    _, first = np.unique(pixels, axis=0, return_index=True)
+    return [keypoints[i] for i in np.sort(order[first])]
+
+
+def extract_features(orb: cv2.ORB, image: np.ndarray) -> Tuple[Optional[np.ndarray], Optional[np.ndarray]]:
+    """
+    Находит ключевые точки, удаляет дубликаты и вычисляет для оставшихся дескрипторы.
+
+    Детекция и вычисление дескрипторов разделены, чтобы дубликаты отсеивались
+    до (относительно дорогого) вычисления дескрипторов.
+
+    Args:
+        orb (cv2.ORB): Детектор, созданный через create_orb().
+        image (np.ndarray): Изображение в градациях серого.
+
+    Returns:
+        Кортеж (массив ключевых точек (N, 7), дескрипторы uint8 (N, 32)) или
+        (None, None), если дескрипторы найти не удалось.
+    """
+    keypoints = orb.detect(image, None)
+    if not keypoints:
+        return None, None
+
+    keypoints, descriptors = orb.compute(image, _remove_duplicate_keypoints(keypoints))
+    if descriptors is None or len(descriptors) == 0:
+        return None, None
+    return keypoints_to_array(keypoints), descriptors
+
+
 def load_and_preprocess_images(
     image_path_1: str, image_path_2: str
 ) -> Optional[Tuple[Image.Image, Image.Image, np.ndarray, np.ndarray]]:
@@ -92,23 +411,17 @@ def load_and_preprocess_images(
         img1_pil = Image.open(image_path_1)
         img2_pil = Image.open(image_path_2)
 
-        # Загрузка для OpenCV (SSIM, ORB)
-        img1_cv = cv2.imread(image_path_1)
-        img2_cv = cv2.imread(image_path_2)
+        # Загрузка для OpenCV (SSIM, ORB): сразу в градациях серого и нужного размера,
+        # без промежуточного BGR-буфера и cvtColor
+        img1_gray = load_gray_image(image_path_1)
+        img2_gray = load_gray_image(image_path_2)
 
         # Критически важная проверка на успешную загрузку OpenCV
-        if img1_cv is None or img2_cv is None:
+        if img1_gray is None or img2_gray is None:
             logger.error("Не удалось загрузить одно или оба изображения с помощью OpenCV: %s, %s", 
                          os.path.basename(image_path_1), os.path.basename(image_path_2))
             return None
 
-        # Предобработка: изменение размера и перевод в серый цвет
-        img1_resized = resize_image(img1_cv)
-        img2_resized = resize_image(img2_cv)
-        
-        img1_gray = cv2.cvtColor(img1_resized, cv2.COLOR_BGR2GRAY)
-        img2_gray = cv2.cvtColor(img2_resized, cv2.COLOR_BGR2GRAY)
-
         return img1_pil, img2_pil, img1_gray, img2_gray
 
     except Exception as e:
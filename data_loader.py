@@ -1,25 +1,46 @@
 import os
-from typing import List
+from typing import Any, Dict, List, Optional, Sequence, Union
 
 from logger import logger
 from settings import GROUP_1_DIR, GROUP_2_DIR
-from core.utils import validate_image_file
+from core.utils import validate_image_files, SUPPORTED_EXTENSIONS
+
+
+def _filter_valid(items: Sequence[Union[str, os.DirEntry]], deep: bool = False) -> List[str]:
+    """
+    Валидирует пути параллельно в пуле потоков и возвращает только валидные.
+
+    Исходный порядок путей сохраняется.
+    deep включает проверку структуры файлов (см. validate_image_file).
+    """
+    flags = validate_image_files(items, deep=deep)
+    return [os.fspath(item) for item, is_valid in zip(items, flags) if is_valid]
+
+
+def _scan_image_entries(directory: str) -> List[os.DirEntry]:
+    """
+    Возвращает записи os.scandir для файлов с поддерживаемыми расширениями.
+
+    Тип файла берется из данных каталога (без отдельного stat на каждый файл),
+    а файлы с другими расширениями отсеиваются до какой-либо проверки.
+    """
+    with os.scandir(directory) as it:
+        return [
+            entry for entry in it
+            if entry.name.lower().endswith(SUPPORTED_EXTENSIONS) and entry.is_file()
+        ]
 
 
 def collect_from_dir(directory: str) -> List[str]:
     """
     Приватная функция для сбора и валидации путей из директории.
     """
-    paths = []
     if not os.path.isdir(directory):
         logger.error("Директория не найдена: %s", directory)
-        return paths
+        return []
         
     logger.info("Сканирование и валидация изображений в: %s", directory)
-    for filename in os.listdir(directory):
-        full_path = os.path.join(directory, filename)
-        if validate_image_file(full_path):
-            paths.append(full_path)
+    paths = _filter_valid(_scan_image_entries(directory))
             
     logger.info("Найдено %d валидных изображений.", len(paths))
     return paths
@@ -29,7 +50,6 @@ def collect_from_dir_with_indices(directory: str):
     Собирает, валидирует пути из директории и присваивает им индекс.
     Сортировка по имени файла обеспечивает предсказуемый и стабильный порядок.
     """
-    paths = []
     if not os.path.isdir(directory):
         logger.error("Директория не найдена: %s", directory)
         return []
@@ -38,15 +58,14 @@ def collect_from_dir_with_indices(directory: str):
     
     # Сортируем файлы по имени для стабильного порядка перед индексацией
     try:
-        sorted_filenames = sorted(os.listdir(directory))
+        sorted_entries = sorted(_scan_image_entries(directory), key=lambda entry: entry.name)
     except FileNotFoundError:
         logger.error("Не удалось прочитать директорию (возможно, удалена во время работы): %s", directory)
         return []
         
-    for filename in sorted_filenames:
-        full_path = os.path.join(directory, filename)
-        if validate_image_file(full_path):
-            paths.append(full_path)
+    # Изображения Group 1 без аналога копируются в результат как есть,
+    # поэтому их структура проверяется полностью
+    paths = _filter_valid(sorted_entries, deep=True)
     
     # КЛЮЧЕВОЙ МОМЕНТ: Используем enumerate для создания кортежей (индекс, путь)
     indexed_paths = list(enumerate(paths))
@@ -55,30 +74,44 @@ def collect_from_dir_with_indices(directory: str):
     return indexed_paths
 
 
-def get_group1_image_paths_with_indices(use_redis_mode: bool):
+def get_group1_image_paths_with_indices(use_redis_mode: bool, session: Optional[Dict[str, Any]] = None):
     """
     Возвращает список кортежей (индекс, путь) для изображений Group 1,
     выбирая источник на основе режима работы.
+
+    session — данные, заранее прочитанные из Redis (см. redis_handler.prefetch_session).
     """
     if use_redis_mode:
         logger.info("Режим: Redis. Получение проиндексированных данных для Group 1...")
         # Вызываем нашу новую функцию из redis_handler
         from redis_handler import get_group1_image_paths_with_indices as get_from_redis
+        if session:
+            return get_from_redis(session.get('csv_raw'), session.get('csv_paths'))
         return get_from_redis()
     else:
         logger.info("Режим: Локальный. Сканирование и индексация директории '%s'...", GROUP_1_DIR)
         # Вызываем новую локальную функцию с индексацией
         return collect_from_dir_with_indices(GROUP_1_DIR)
 
-def get_group2_image_paths(use_redis_mode: bool) -> List[str]:
+def get_group2_image_paths(use_redis_mode: bool, session: Optional[Dict[str, Any]] = None) -> List[str]:
     """
     Возвращает список путей к изображениям для Group 2.
     Здесь индексация не нужна, так как это база для поиска.
+
+    session — данные, заранее прочитанные из Redis (см. redis_handler.prefetch_session).
     """
     if use_redis_mode:
         logger.info("Режим: Redis. Получение данных для Group 2...")
-        from redis_handler import get_group2_dir_paths 
-        dir_path = get_group2_dir_paths()
+        from redis_handler import get_group2_file_paths, get_group2_dir_paths
+
+        # Если источник уже передал список файлов, директория не сканируется
+        # и файлы не проверяются по одному: отбираются только поддерживаемые
+        # расширения, а нечитаемые изображения отсеются при построении кэша
+        file_paths = get_group2_file_paths(session.get('group2_files') if session else None)
+        if file_paths:
+            return [path for path in file_paths if path.lower().endswith(SUPPORTED_EXTENSIONS)]
+
+        dir_path = get_group2_dir_paths(session.get('group2_dir') if session else None)
         
         # Здесь используется обычная функция сбора без индексов
         return collect_from_dir(dir_path) if dir_path else []
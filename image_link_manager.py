@@ -2,9 +2,24 @@ import csv
 import io
 import os
 import logging
-from typing import List, Dict, Any, Iterator, Tuple, Optional
+from typing import List, Dict, Any, Iterator, Tuple, Optional, Union
 from redis import Redis
-from settings import REDIS_TEMP_CSV_PATH
+from settings import REDIS_TEMP_CSV_PATH, CSV_IMAGE_COLUMN, CSV_CELL_DELIMITER, CSV_IMAGE_DELIMITER
+
+# Размер буфера чтения CSV-файлов
+_READ_BUFFER_SIZE = 1 << 20
+
+def _iter_csv_lines(text: str) -> Iterator[str]:
+    """
+    Лениво отдает строки текста вместе с символом перевода строки (как файл с newline="").
+    """
+    start = 0
+    text_len = len(text)
+    while start < text_len:
+        end = text.find("\n", start) + 1 or text_len
+        yield text[start:end]
+        start = end
+
 
 class ImageLinkManager:
     """
@@ -17,9 +32,9 @@ class ImageLinkManager:
                  output_path: str,
                  headers: List[str],
                  rows: List[Dict[str, Any]],
-                 image_column_name: str = "Ссылки на изображения",
-                 delimiter: str = "|",
-                 image_delimiter: str = ";"):
+                 image_column_name: str = CSV_IMAGE_COLUMN,
+                 delimiter: str = CSV_CELL_DELIMITER,
+                 image_delimiter: str = CSV_IMAGE_DELIMITER):
         """
         Приватный конструктор. Используйте from_file() или from_redis() для создания экземпляра.
         """
@@ -30,42 +45,66 @@ class ImageLinkManager:
         self.delimiter = delimiter
         self.image_delimiter = image_delimiter
 
+    @staticmethod
+    def _parse_rows(reader: Iterator[List[str]],
+                    headers: List[str],
+                    image_column_name: str,
+                    image_delimiter: str) -> List[Dict[str, Any]]:
+        """
+        Превращает строки csv.reader в словари, разбивая колонку изображений на список ссылок.
+
+        Индекс колонки изображений вычисляется один раз, поэтому по ячейкам строки
+        не нужно проходить с проверкой имени заголовка.
+        """
+        n_columns = len(headers)
+        img_col_idx = headers.index(image_column_name) if image_column_name in headers else -1
+        padding = [""] * n_columns
+
+        rows = []
+        for row_values in reader:
+            if len(row_values) < n_columns:
+                row_values = row_values + padding[len(row_values):]
+            parsed_row = dict(zip(headers, row_values))
+            if img_col_idx >= 0:
+                value = row_values[img_col_idx]
+                if value:
+                    parsed_row[image_column_name] = [link for link in map(str.strip, value.split(image_delimiter)) if link]
+            rows.append(parsed_row)
+        return rows
+
     @classmethod
     def from_redis(cls,
                    redis_client: Redis,
                    chat_id: int,
-                   image_column_name: str = "Ссылки на изображения",
-                   delimiter: str = "|",
-                   image_delimiter: str = ";") -> Optional['ImageLinkManager']:
+                   image_column_name: str = CSV_IMAGE_COLUMN,
+                   delimiter: str = CSV_CELL_DELIMITER,
+                   image_delimiter: str = CSV_IMAGE_DELIMITER,
+                   csv_data: Optional[Union[str, bytes]] = None) -> Optional['ImageLinkManager']:
         """
         Фабричный метод: создает экземпляр ImageLinkManager, загружая данные из Redis.
+
+        Если CSV уже был прочитан из Redis (например, в prefetch_session), его можно
+        передать в csv_data — тогда повторного запроса к Redis не будет.
         """
         logging.info(f"Попытка загрузить CSV данные из Redis для CHAT_ID: {chat_id}")
         try:
-            csv_data = redis_client.get(f'{chat_id}:csv:raw')
+            if csv_data is None:
+                csv_data = redis_client.get(f'{chat_id}:csv:raw')
 
             if not csv_data:
                 logging.error(f"В Redis не найдены CSV данные по ключу '{chat_id}:csv:raw'")
                 return None
-            if not csv_data:
-                logging.error(f"В Redis не найден путь для сохранения по ключу '{chat_id}:OUTPUT_FILE_PATH'")
-                return None
 
-            # Используем io.StringIO для чтения строки как файла
-            csvfile = io.StringIO(csv_data)
-            reader = csv.reader(csvfile, delimiter=delimiter)
+            # csv.reader получает строки по одной, без копии всего CSV в io.StringIO:
+            # байты декодируются по частям прямо при разборе, строка режется на ходу
+            if isinstance(csv_data, bytes):
+                lines = io.TextIOWrapper(io.BytesIO(csv_data), encoding="utf-8", newline="")
+            else:
+                lines = _iter_csv_lines(csv_data)
+            reader = csv.reader(lines, delimiter=delimiter)
             
             headers = next(reader)
-            rows = []
-            for row_values in reader:
-                parsed_row = {}
-                for i, header in enumerate(headers):
-                    value = row_values[i] if i < len(row_values) else ""
-                    if header == image_column_name and value:
-                        parsed_row[header] = [link.strip() for link in value.split(image_delimiter) if link.strip()]
-                    else:
-                        parsed_row[header] = value
-                rows.append(parsed_row)
+            rows = cls._parse_rows(reader, headers, image_column_name, image_delimiter)
             
             logging.info(f"Успешно загружено и распарсено {len(rows)} строк из Redis.")
             return cls(REDIS_TEMP_CSV_PATH, headers, rows, image_column_name, delimiter, image_delimiter)
@@ -77,27 +116,20 @@ class ImageLinkManager:
     @classmethod
     def from_file(cls,
                   csv_path: str,
-                  image_column_name: str = "Ссылки на изображения",
-                  delimiter: str = "|",
-                  image_delimiter: str = ";") -> Optional['ImageLinkManager']:
+                  image_column_name: str = CSV_IMAGE_COLUMN,
+                  delimiter: str = CSV_CELL_DELIMITER,
+                  image_delimiter: str = CSV_IMAGE_DELIMITER) -> Optional['ImageLinkManager']:
         """
         Фабричный метод: создает экземпляр ImageLinkManager, загружая данные из файла.
         """
         logging.info(f"Попытка загрузить CSV данные из файла: {csv_path}")
         try:
-            with open(csv_path, "r", encoding="utf-8") as csvfile:
+            # csv.reader — C-парсер; крупный буфер сокращает число чтений с диска,
+            # а newline="" передает ему переводы строк как есть (как требует модуль csv)
+            with open(csv_path, "r", encoding="utf-8", newline="", buffering=_READ_BUFFER_SIZE) as csvfile:
                 reader = csv.reader(csvfile, delimiter=delimiter)
                 headers = next(reader)
-                rows = []
-                for row_values in reader:
-                    parsed_row = {}
-                    for i, header in enumerate(headers):
-                        value = row_values[i] if i < len(row_values) else ""
-                        if header == image_column_name and value:
-                            parsed_row[header] = [link.strip() for link in value.split(image_delimiter) if link.strip()]
-                        else:
-                            parsed_row[header] = value
-                    rows.append(parsed_row)
+                rows = cls._parse_rows(reader, headers, image_column_name, image_delimiter)
             
             logging.info(f"Успешно загружено {len(rows)} строк из файла {csv_path}.")
             # При загрузке из файла, сохраняем в тот же файл
@@ -126,6 +158,20 @@ class ImageLinkManager:
 
     # --- Метод для сохранения ---
 
+    def _iter_row_values(self) -> Iterator[List[Any]]:
+        """
+        Отдает строки в виде списков значений в порядке заголовков.
+
+        Список ссылок на изображения склеивается обратно через image_delimiter.
+        Строки не копируются — значения берутся из словарей напрямую.
+        """
+        img_col_idx = self.headers.index(self.image_column_name) if self.image_column_name in self.headers else -1
+        for row in self.rows:
+            values = [row.get(header, "") for header in self.headers]
+            if img_col_idx >= 0 and isinstance(values[img_col_idx], list):
+                values[img_col_idx] = self.image_delimiter.join(values[img_col_idx])
+            yield values
+
     def save_changes_and_get_content(self) -> Optional[str]:
         """
         Собирает CSV в строку, сохраняет ее в файл self.output_path и возвращает эту строку.
@@ -138,14 +184,9 @@ class ImageLinkManager:
                 
             # Используем io.StringIO для эффективной сборки CSV в памяти
             string_buffer = io.StringIO()
-            writer = csv.DictWriter(string_buffer, fieldnames=self.headers, delimiter=self.delimiter, lineterminator='\n')
-            writer.writeheader()
-            
-            for row in self.rows:
-                row_to_write = row.copy()
-                if self.image_column_name in row_to_write and isinstance(row_to_write[self.image_column_name], list):
-                    row_to_write[self.image_column_name] = self.image_delimiter.join(row_to_write[self.image_column_name])
-                writer.writerow(row_to_write)
+            writer = csv.writer(string_buffer, delimiter=self.delimiter, lineterminator='\n')
+            writer.writerow(self.headers)
+            writer.writerows(self._iter_row_values())
             
             # Получаем финальный контент из буфера
             updated_csv_content = string_buffer.getvalue()
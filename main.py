@@ -3,7 +3,6 @@ import sys
 import argparse
 
 from logger import logger
-from pipeline import run_pipeline
 
 if __name__ == "__main__":
     parser = argparse.ArgumentParser(
@@ -24,12 +23,15 @@ if __name__ == "__main__":
 
     # Проверяем CHAT_ID только если мы действительно работаем в режиме Redis
     if parsed_args.use_redis:
-        # Импортируем CHAT_ID здесь, локально, чтобы избежать ошибок при --local
-        from redis_handler import CHAT_ID
+        from settings import CHAT_ID
         if not CHAT_ID:
             logger.error("Ошибка: для работы в режиме Redis необходимо установить переменную окружения CHAT_ID.")
             sys.exit(1)
     
+    # Конвейер (OpenCV, FAISS и т.д.) импортируем только после разбора аргументов,
+    # чтобы `--help` и ошибки в аргументах не ждали загрузки тяжелых модулей
+    from pipeline import run_pipeline
+
     # Запускаем основной конвейер обработки
     try:
         run_pipeline(parsed_args.use_redis)
@@ -1,101 +1,187 @@
+import logging
 import os
 import shutil
-from typing import List, Optional
+from dataclasses import dataclass
+from typing import Any, Dict, List, Optional, Set
 
 from logger import logger
 # Добавляем OUTPUT_DIR из настроек
-from settings import DESCRIPTORS_CACHE_PATH, OUTPUT_DIR
-from core.cacher import DescriptorCacher
-from core.searcher import Searcher
+from settings import CHAT_ID, DESCRIPTORS_CACHE_PATH, OUTPUT_DIR, OUTPUT_USE_HARDLINKS
 
 # Модули для работы с данными
 import data_loader
-from image_link_manager import ImageLinkManager
 
-# Redis
-from redis_handler import get_redis_client, CHAT_ID
+# Разделитель блоков в логе
+_SEP = "=" * 60
 
-def _prepare_output_directory(chat_id: str) -> Optional[str]:
+# Тяжелые модули (OpenCV, FAISS, Redis) импортируются внутри функций, которые
+# их используют: `main.py --help` не платит за их загрузку, а локальный режим
+# не импортирует redis_handler (и redis-py) вовсе — CHAT_ID берется из settings.py.
+
+@dataclass(frozen=True)
+class PipelineConfig:
+    """
+    Параметры одного запуска конвейера.
+
+    Собираются один раз в run_pipeline (из Redis или settings.py) и передаются
+    всем этапам вместо отдельных флагов.
+    """
+    use_redis: bool
+    keep_unmatched: bool
+    chat_id: Optional[str]
+    cache_path: str = DESCRIPTORS_CACHE_PATH
+    output_dir: str = OUTPUT_DIR
+    use_hardlinks: bool = OUTPUT_USE_HARDLINKS
+
+
+def _prepare_output_directory(output_root: str, chat_id: str) -> Optional[str]:
     """
-    Создает чистую выходную директорию для сессии пользователя.
-    Удаляет старые файлы, если они есть.
+    Создает выходную директорию для сессии пользователя, если ее еще нет.
+
+    Старые файлы здесь не удаляются: совпадающие с новым результатом остаются
+    на месте, а лишние убирает _remove_stale_outputs после формирования результата.
     """
     try:
         # Создаем уникальный путь для каждого пользователя
-        session_output_dir = os.path.join(OUTPUT_DIR, chat_id)
-        
-        # Удаляем директорию, если она существует, для чистого запуска
-        if os.path.exists(session_output_dir):
-            shutil.rmtree(session_output_dir)
-        
-        # Создаем директорию
+        session_output_dir = os.path.join(output_root, chat_id)
         os.makedirs(session_output_dir, exist_ok=True)
-        logger.info("Создана чистая выходная директория: %s", session_output_dir)
+        logger.info("Выходная директория: %s", session_output_dir)
         return session_output_dir
     except Exception as e:
         logger.error("Не удалось создать выходную директорию: %s", e)
         return None
 
 
-def _build_descriptor_cache(use_redis_mode: bool) -> bool:
+def _remove_stale_outputs(output_dir: str, keep_names: Set[str]):
+    """
+    Удаляет из выходной директории все, что не входит в новый результат.
+    """
+    with os.scandir(output_dir) as it:
+        stale_entries = [entry for entry in it if entry.name not in keep_names]
+
+    for entry in stale_entries:
+        try:
+            if entry.is_dir(follow_symlinks=False):
+                shutil.rmtree(entry.path)
+            else:
+                os.unlink(entry.path)
+        except OSError as e:
+            logger.warning("Не удалось удалить устаревший файл %s: %s", entry.path, e)
+    if stale_entries:
+        logger.info("Удалено устаревших файлов из выходной директории: %d", len(stale_entries))
+
+
+def _materialize(source_path: str, destination_path: str, use_hardlinks: bool) -> bool:
+    """
+    Размещает файл в выходной директории без копирования содержимого, если это возможно.
+
+    Если по этому пути уже лежит жесткая ссылка на тот же файл (результат
+    прошлого запуска), ничего не делается; иначе старый файл заменяется.
+    Сначала создается жесткая ссылка (мгновенно, данные не перечитываются и не
+    пишутся заново). Если ссылка невозможна — другая файловая система (EXDEV) или
+    ФС без поддержки жестких ссылок — файл копируется целиком.
+
+    Жесткая ссылка разделяет inode с исходным файлом Group 1/Group 2: изменение
+    выходного файла на месте изменит и исходное изображение. Удаление или замена
+    выходного файла (как в _remove_stale_outputs) исходный файл не затрагивает.
+    При use_hardlinks=False (см. OUTPUT_USE_HARDLINKS в settings.py) файл
+    всегда копируется.
+
+    Returns:
+        True, если выходной файл — жесткая ссылка на исходный, False, если это копия.
+    """
+    try:
+        if use_hardlinks and os.path.samefile(source_path, destination_path):
+            return True
+        os.unlink(destination_path)
+    except FileNotFoundError:
+        pass
+
+    if use_hardlinks:
+        try:
+            os.link(source_path, destination_path)
+            return True
+        except OSError:
+            pass
+    shutil.copy2(source_path, destination_path)
+    return False
+
+
+def _build_descriptor_cache(cfg: PipelineConfig, session: Optional[Dict[str, Any]] = None) -> bool:
     """
     ЭТАП 1: Создает кэш дескрипторов для изображений из Group 2.
     """
+    from core.cacher import DescriptorCacher
+
     logger.info("--- ЭТАП 1: Создание кэша дескрипторов ---")
-    group2_paths = data_loader.get_group2_image_paths(use_redis_mode)
+    group2_paths = data_loader.get_group2_image_paths(cfg.use_redis, session)
     if not group2_paths:
         logger.error("В источнике данных нет изображений для Group 2. Завершение работы.")
         return False
     cacher = DescriptorCacher(group2_paths)
-    cacher.create_and_save_cache(DESCRIPTORS_CACHE_PATH)
+    cacher.create_and_save_cache(cfg.cache_path)
     return True
 
-def _process_query_images(use_redis_mode: bool, keep_unmatched_images: bool) -> List[str]:
+def _process_query_images(cfg: PipelineConfig, session: Optional[Dict[str, Any]] = None) -> List[str]:
     """
     ЭТАП 2: Ищет аналоги, копирует результат (аналог или оригинал) в новую
     директорию с именем, соответствующим индексу, и возвращает список путей к новым файлам.
     """
+    from core.searcher import get_searcher
+
     logger.info("--- ЭТАП 2: Поиск аналогов и формирование итогового набора изображений ---")
     
     # 0. Готовим выходную директорию
-    output_dir = _prepare_output_directory(CHAT_ID)
+    output_dir = _prepare_output_directory(cfg.output_dir, cfg.chat_id)
     if not output_dir:
         return []
 
     results_with_indices = []
     try:
-        searcher = Searcher(DESCRIPTORS_CACHE_PATH)
+        searcher = get_searcher(cfg.cache_path)
     except Exception as e:
-        logger.error("Критическая ошибка: не удалось загрузить кэш '%s': %s", DESCRIPTORS_CACHE_PATH, e)
+        logger.error("Критическая ошибка: не удалось загрузить кэш '%s': %s", cfg.cache_path, e)
+        _remove_stale_outputs(output_dir, set())
         return []
 
     # 1. ПОЛУЧАЕМ ДАННЫЕ С ИНДЕКСАМИ
-    group1_data = data_loader.get_group1_image_paths_with_indices(use_redis_mode)
+    group1_data = data_loader.get_group1_image_paths_with_indices(cfg.use_redis, session)
     if not group1_data:
         logger.warning("В источнике данных для Group 1 не найдено изображений.")
+        _remove_stale_outputs(output_dir, set())
         return []
 
-    # 2. ОБРАБАТЫВАЕМ ИЗОБРАЖЕНИЯ, КОПИРУЕМ И СОХРАНЯЕМ НОВЫЙ ПУТЬ
-    for original_index, img1_path in group1_data:
-        logger.info("=" * 60)
-        logger.info("Обработка позиции %d (файл: %s)", original_index, os.path.basename(img1_path))
+    # 2. ИЩЕМ АНАЛОГИ ДЛЯ ВСЕХ ИЗОБРАЖЕНИЙ СРАЗУ
+    # Признаки всех изображений извлекаются параллельно в пуле процессов,
+    # а затем дескрипторы сравниваются с базой одним поиском
+    query_paths = [img1_path for _, img1_path in group1_data]
+    found_match_paths = searcher.find_matches_batch(query_paths)
+
+    # 3. КОПИРУЕМ ВЫБРАННЫЙ ФАЙЛ И СОХРАНЯЕМ НОВЫЙ ПУТЬ
+    # Если INFO отключен, не вычисляем аргументы для подробного лога на каждой позиции
+    info_on = logger.isEnabledFor(logging.INFO)
+    query_names = list(map(os.path.basename, query_paths)) if info_on else [None] * len(query_paths)
+    for (original_index, img1_path), img1_name, found_match_path in zip(group1_data, query_names, found_match_paths):
+        if info_on:
+            logger.info(_SEP)
+            logger.info("Обработка позиции %d (файл: %s)", original_index, img1_name)
 
         source_path_for_copy = None
-        found_match_path = searcher.find_match(img1_path)
 
         if found_match_path:
-            logger.info("✅ Найден аналог: %s", os.path.basename(found_match_path))
+            if info_on:
+                logger.info("✅ Найден аналог: %s", os.path.basename(found_match_path))
             source_path_for_copy = found_match_path
         else:
             logger.warning("⚠️ Аналог не найден.")
-            if keep_unmatched_images:
+            if cfg.keep_unmatched:
                 logger.info("Сохраняем исходное изображение.")
                 source_path_for_copy = img1_path
             else:
                 logger.info("Отбрасываем изображение.")
                 continue  # Пропускаем эту позицию, файл не будет создан
 
-        # 3. КОПИРУЕМ ВЫБРАННЫЙ ФАЙЛ В ВЫХОДНУЮ ДИРЕКТОРИЮ С НОВЫМ ИМЕНЕМ
+        # Копируем выбранный файл в выходную директорию с новым именем
         try:
             # Получаем расширение исходного файла
             _, extension = os.path.splitext(source_path_for_copy)
@@ -104,15 +190,20 @@ def _process_query_images(use_redis_mode: bool, keep_unmatched_images: bool) ->
             destination_name = f"{original_index}{extension}"
             destination_path = os.path.join(output_dir, destination_name)
 
-            # Копируем файл
-            shutil.copy2(source_path_for_copy, destination_path)
-            logger.info("Файл скопирован в: %s", destination_path)
+            # Создаем жесткую ссылку (или копируем файл, если ссылка невозможна)
+            if _materialize(source_path_for_copy, destination_path, cfg.use_hardlinks):
+                logger.info("Создана жесткая ссылка: %s", destination_path)
+            else:
+                logger.info("Файл скопирован в: %s", destination_path)
             
             # Сохраняем кортеж с индексом и ПУТЕМ К НОВОМУ ФАЙЛУ
             results_with_indices.append((original_index, destination_path))
 
         except Exception as e:
-            logger.error("Не удалось скопировать файл %s: %s", source_path_for_copy, e)
+            logger.error("Не удалось разместить файл %s в выходной директории: %s", source_path_for_copy, e)
+
+    # Убираем файлы прошлых запусков, которых нет в новом результате
+    _remove_stale_outputs(output_dir, {os.path.basename(path) for _, path in results_with_indices})
 
     # 4. СОРТИРУЕМ РЕЗУЛЬТАТЫ (хотя они и так должны быть по порядку, это для 100% гарантии)
     results_with_indices.sort(key=lambda item: item[0])
@@ -124,26 +215,36 @@ def _process_query_images(use_redis_mode: bool, keep_unmatched_images: bool) ->
     return final_list
 
 
-def _update_source_and_report(final_image_list: List[str], use_redis_mode: bool):
+def _update_source_and_report(final_image_list: List[str], cfg: PipelineConfig,
+                              session: Optional[Dict[str, Any]] = None):
     """
     ЭТАП 3: Обновляет источник данных (если Redis) и выводит отчет.
     Эта функция НЕ МЕНЯЕТСЯ, т.к. она просто принимает готовый список путей.
     """
     logger.info("\n--- ЭТАП 3: Обновление источника и формирование отчета ---")
 
-    if use_redis_mode:
+    if cfg.use_redis:
         logger.info("Режим: Redis. Обновление CSV в Redis...")
-        redis_client = get_redis_client()
-        if redis_client and CHAT_ID:
+        from image_link_manager import ImageLinkManager
+        from redis_handler import compress_csv_payload, get_redis_bytes_client
+
+        # Тот же клиент (и пул соединений), что и при чтении данных сессии
+        redis_client = get_redis_bytes_client()
+        if redis_client and cfg.chat_id:
             # ImageLinkManager принимает финальный список и корректно его записывает
-            manager = ImageLinkManager.from_redis(redis_client, CHAT_ID)
+            # CSV уже прочитан вместе с остальными ключами сессии — не запрашиваем его снова
+            csv_data = session['csv_raw'] if session else None
+            manager = ImageLinkManager.from_redis(redis_client, cfg.chat_id, csv_data=csv_data)
             if not manager:
                 logger.error("Не удалось инициализировать менеджер CSV из Redis.")
             elif manager.rows:
                 manager.set_image_links(0, final_image_list)
                 updated_content = manager.save_changes_and_get_content()
                 if updated_content:
-                    redis_client.set(f'{CHAT_ID}:csv:raw', updated_content)
+                    # CSV записывается в том же виде, в каком пришел (сжатым или нет)
+                    if session and session.get('csv_compressed'):
+                        updated_content = compress_csv_payload(updated_content)
+                    redis_client.set(f'{cfg.chat_id}:csv:raw', updated_content)
                     logger.info("✅ Обновлённый CSV успешно сохранён в Redis.")
                 else:
                     logger.error("Ошибка при сохранении CSV файла на диск.")
@@ -152,14 +253,14 @@ def _update_source_and_report(final_image_list: List[str], use_redis_mode: bool)
         else:
              logger.error("Не удалось получить клиент Redis или CHAT_ID не установлен.")
 
-    logger.info("\n" + "="*60)
+    logger.info("\n" + _SEP)
     logger.info("ИТОГ: Сформирован финальный список из %d изображений:", len(final_image_list))
     if final_image_list:
         for img_path in final_image_list:
             print(f"🖼️  {img_path}")
     else:
         logger.info("Финальный список пуст.")
-    logger.info("="*60)
+    logger.info(_SEP)
 
 
 def run_pipeline(use_redis: bool):
@@ -170,13 +271,17 @@ def run_pipeline(use_redis: bool):
     # ... (код этой функции остается таким же, как у вас)
     # --- 1. ЗАГРУЗКА КОНФИГУРАЦИИ ---
     keep_unmatched_images = True  # Безопасное значение по умолчанию
+    session = None
 
     if use_redis:
         logger.info("Загрузка конфигурации из Redis...")
-        redis_client = get_redis_client()
-        if redis_client:
+        from redis_handler import prefetch_session
+
+        # Все входные данные сессии читаются одним запросом и передаются этапам
+        session = prefetch_session(CHAT_ID)
+        if session:
             config_key = f'{CHAT_ID}:KEEP_UNMATCHED'
-            config_value = redis_client.get(config_key)
+            config_value = session['keep_unmatched']
             if config_value is not None:
                 keep_unmatched_images = config_value.lower() == 'true'
                 logger.info("Настройка KEEP_UNMATCHED из Redis ('%s'): %s", config_key, keep_unmatched_images)
@@ -188,10 +293,12 @@ def run_pipeline(use_redis: bool):
         keep_unmatched_images = KEEP_UNMATCHED_IMAGES
         logger.info("Настройка KEEP_UNMATCHED из settings.py: %s", keep_unmatched_images)
 
+    cfg = PipelineConfig(use_redis=use_redis, keep_unmatched=keep_unmatched_images, chat_id=CHAT_ID)
+
     # --- 2. ВЫПОЛНЕНИЕ ЭТАПОВ КОНВЕЙЕРА ---
-    if not _build_descriptor_cache(use_redis):
+    if not _build_descriptor_cache(cfg, session):
         return
 
-    final_list = _process_query_images(use_redis, keep_unmatched_images)
+    final_list = _process_query_images(cfg, session)
 
-    _update_source_and_report(final_list, use_redis)
+    _update_source_and_report(final_list, cfg, session)
@@ -6,139 +6,600 @@
 при импорте модуля. Это делает его безопасным для использования в
 любом режиме работы приложения.
 """
-import os
+import atexit
+import gzip
+import hashlib
+import re
+import threading
+import time
+import msgpack
 import redis
+import asyncio
 import csv
 import io
-from typing import List, Optional
+from operator import itemgetter
+from typing import Any, Dict, List, Optional, Tuple
 
 # Импортируем общие компоненты проекта
 from logger import logger
 from settings import (
-    REDIS_HOST, REDIS_PORT, REDIS_DB,
-    CSV_IMAGE_COLUMN, CSV_CELL_DELIMITER, CSV_IMAGE_DELIMITER
+    CHAT_ID, REDIS_HOST, REDIS_PORT, REDIS_DB, REDIS_MAX_CONNECTIONS, REDIS_RETRY_INTERVAL,
+    REDIS_SOCKET_KEEPALIVE, REDIS_SOCKET_KEEPALIVE_OPTIONS, REDIS_HEALTH_CHECK_INTERVAL,
+    CSV_IMAGE_COLUMN, CSV_CELL_DELIMITER, CSV_IMAGE_DELIMITER, CSV_PATHS_CACHE_TTL
 )
-from core.utils import validate_image_file
+from core.utils import validate_image_files
 
-# --- БЕЗОПАСНАЯ ИНИЦИАЛИЗАЦИЯ ПЕРЕМЕННЫХ ---
+# Один путь внутри ячейки: без разделителя и без пробелов по краям. findall
+# выделяет, очищает и отбрасывает пустые пути одним проходом регулярного выражения
+_IMAGE_DELIMITER_CLASS = re.escape(CSV_IMAGE_DELIMITER)
+_IMAGE_PATH_RE = re.compile(
+    rf'[^{_IMAGE_DELIMITER_CLASS}\s](?:[^{_IMAGE_DELIMITER_CLASS}]*[^{_IMAGE_DELIMITER_CLASS}\s])?'
+)
+
+# Источник может сохранять CSV сжатым gzip (в разы меньше передается по сети);
+# сжатый CSV узнается по сигнатуре
+_GZIP_MAGIC = b'\x1f\x8b'
+_GZIP_LEVEL = 6
+
+# Пул соединений. Все вызывающие используют уже открытые TCP-соединения из пула,
+# а не устанавливают новое при каждом переподключении. Создается лениво.
+_redis_pool: Optional[redis.BlockingConnectionPool] = None
+
+# Последняя попытка подключения не удалась и когда она была (по time.monotonic)
+_redis_init_failed = False
+_last_init_attempt = 0.0
+
+# Асинхронный клиент (redis.asyncio) для вызывающих, работающих в asyncio. Создается лениво,
+# неудачные попытки подключения учитываются отдельно от синхронного клиента
+_async_redis_client = None
+_async_init_failed = False
+_async_last_init_attempt = 0.0
+
+# Защищает создание пула и клиента от гонки при первом вызове из нескольких потоков
+_init_lock = threading.Lock()
 
-# Просто читаем переменную. Будет None, если не установлена. Не вызывает ошибок.
-CHAT_ID: Optional[str] = os.getenv('CHAT_ID')
+# То же для асинхронного клиента: сопрограммы, одновременно сделавшие первый
+# вызов (например, через asyncio.gather), не создают каждая свой пул
+_async_init_lock = asyncio.Lock()
 
-# Приватная переменная для хранения клиента. Будет создана лениво.
-_redis_client: Optional[redis.Redis] = None
+# Клиент без декодирования ответов: большие значения (CSV) разбираются потоково
+# из байтов, без промежуточной строки, а короткие декодируются явно. Будет создан лениво.
+_redis_bytes_client: Optional[redis.Redis] = None
 
 
-def get_redis_client() -> Optional[redis.Redis]:
+def _pool_options() -> Dict[str, Any]:
     """
-    "Ленивый" и безопасный способ получить клиент Redis.
-    Подключается только при первом вызове. Возвращает None в случае ошибки.
+    Параметры пула соединений Redis (общие для синхронного и асинхронного клиентов).
+
+    Keepalive и периодическая проверка соединений задаются на уровне пула,
+    поэтому их получает каждое соединение.
     """
-    global _redis_client
+    return {
+        'host': REDIS_HOST,
+        'port': REDIS_PORT,
+        'db': REDIS_DB,
+        'max_connections': REDIS_MAX_CONNECTIONS,
+        'socket_keepalive': REDIS_SOCKET_KEEPALIVE,
+        'socket_keepalive_options': REDIS_SOCKET_KEEPALIVE_OPTIONS,
+        'health_check_interval': REDIS_HEALTH_CHECK_INTERVAL,
+    }
+
 
-    # Если клиент уже успешно создан, просто возвращаем его
-    if _redis_client:
-        return _redis_client
+def _connect() -> Optional[redis.Redis]:
+    """
+    Создает клиент Redis и проверяет соединение. Возвращает None в случае ошибки.
+    """
+    global _redis_pool, _redis_init_failed, _last_init_attempt
 
-    # Первый вызов: выполняем все проверки и подключение
     if not CHAT_ID:
         logger.error("Критическая ошибка: попытка использовать Redis, но CHAT_ID не установлен!")
         return None
 
+    # После неудачного подключения новые попытки не делаются REDIS_RETRY_INTERVAL секунд:
+    # при недоступном сервере каждая из них ждала бы таймаута соединения
+    if _redis_init_failed and time.monotonic() - _last_init_attempt < REDIS_RETRY_INTERVAL:
+        logger.debug("Redis недоступен (последняя попытка подключения не удалась), повтор позже.")
+        return None
+
     try:
-        client = redis.Redis(
-            host=REDIS_HOST,
-            port=REDIS_PORT,
-            db=REDIS_DB,
-            decode_responses=True  # Автоматически декодировать ответы из utf-8
-        )
+        if _redis_pool is None:
+            _redis_pool = redis.BlockingConnectionPool(**_pool_options())
+        client = redis.Redis(connection_pool=_redis_pool)
         # Проверяем соединение
         client.ping()
         logger.info("Успешное подключение к Redis по адресу %s:%d", REDIS_HOST, REDIS_PORT)
-        
-        # Сохраняем успешный клиент в глобальную переменную для последующих вызовов
-        _redis_client = client
-        return _redis_client
+        _redis_init_failed = False
+        return client
 
     except redis.exceptions.ConnectionError as e:
         logger.error("Не удалось подключиться к Redis: %s", e)
+        _redis_init_failed = True
+        _last_init_attempt = time.monotonic()
         return None
 
 
-def get_group1_image_paths_with_indices() -> List[tuple[int, str]]:
+def get_redis_bytes_client() -> Optional[redis.Redis]:
     """
-    Извлекает CSV из Redis, парсит его и возвращает список кортежей
-    (индекс, путь) для изображений Group 1, сохраняя их исходный порядок.
+    "Ленивый" и безопасный способ получить клиент Redis (ответы — bytes, без декодирования).
+    Подключается только при первом вызове. Возвращает None в случае ошибки.
+    """
+    global _redis_bytes_client
+
+    # Первый вызов: выполняем все проверки и подключение.
+    # Успешный клиент сохраняем в глобальную переменную для последующих вызовов.
+    # Проверка повторяется под блокировкой, чтобы потоки, одновременно сделавшие
+    # первый вызов, не создавали каждый свой клиент; после инициализации
+    # блокировка не берется.
+    if _redis_bytes_client is not None:
+        return _redis_bytes_client
+    with _init_lock:
+        if _redis_bytes_client is None:
+            _redis_bytes_client = _connect()
+    return _redis_bytes_client
+
+
+def reset_redis_client():
+    """
+    Снимает запрет на повторное подключение после ошибки: следующий вызов
+    get_redis_bytes_client() сразу попробует подключиться заново.
+    """
+    global _redis_init_failed, _async_init_failed
+
+    _redis_init_failed = False
+    _async_init_failed = False
+
+
+def close_redis():
+    """
+    Закрывает все соединения пула Redis и сбрасывает сохраненный клиент.
+
+    Вызывается при завершении работы; следующий get_redis_bytes_client() подключится заново.
+    """
+    global _redis_pool, _redis_bytes_client
+
+    with _init_lock:
+        if _redis_pool is not None:
+            _redis_pool.disconnect()
+        _redis_pool = None
+        _redis_bytes_client = None
+    reset_redis_client()
+
+
+# Пул общий для всего процесса (и всех запусков конвейера в нем),
+# поэтому соединения закрываются один раз — при завершении процесса
+atexit.register(close_redis)
+
+
+def prefetch_session(chat_id: str) -> Optional[Dict[str, Any]]:
     """
-    client = get_redis_client()
+    Читает все входные данные сессии из Redis за один сетевой обмен.
+
+    Команды отправляются одним конвейером (без транзакции), поэтому вместо
+    отдельного запроса на каждый ключ выполняется один round-trip.
+
+    Returns:
+        Словарь с ключами 'keep_unmatched' (str или None), 'csv_raw' (bytes или None,
+        уже распакованный), 'csv_compressed' (был ли CSV в Redis сжат gzip),
+        'csv_paths' (сохраненный результат разбора CSV, bytes; b'' — если его нет),
+        'group2_files' (список str, возможно пустой) и 'group2_dir' (str или None),
+        либо None, если Redis недоступен.
+    """
+    client = get_redis_bytes_client()
     if not client:
-        return []  # Не удалось получить клиент, возвращаем пустой список
+        return None
 
-    _REDIS_CSV_KEY = f'{CHAT_ID}:csv:raw'
-    logger.info("Получение CSV для Group 1 из Redis (ключ: '%s')", _REDIS_CSV_KEY)
+    pipe = client.pipeline(transaction=False)
+    _queue_session_reads(pipe, chat_id)
+    return _session_from_results(pipe.execute())
+
+
+def _queue_session_reads(pipe: Any, chat_id: str):
+    """
+    Добавляет в конвейер (синхронный или асинхронный) чтение всех ключей сессии.
+    """
+    pipe.get(f'{chat_id}:KEEP_UNMATCHED')
+    pipe.get(f'{chat_id}:csv:raw')
+    pipe.get(f'{chat_id}:csv:paths')
+    pipe.lrange(f'{chat_id}:GROUP2_FILES', 0, -1)
+    pipe.get(f'{chat_id}:GROUP2_DIR_IMAGES')
+
+
+def _session_from_results(results: List[Any]) -> Dict[str, Any]:
+    """
+    Собирает словарь сессии (см. prefetch_session) из ответов конвейера _queue_session_reads.
+    """
+    keep_unmatched, csv_raw, csv_paths, group2_files, group2_dir = results
+    csv_raw, csv_compressed = decompress_csv_payload(csv_raw)
 
-    csv_data = client.get(_REDIS_CSV_KEY)
+    return {
+        'keep_unmatched': keep_unmatched.decode('utf-8') if keep_unmatched is not None else None,
+        'csv_raw': csv_raw,
+        'csv_compressed': csv_compressed,
+        'csv_paths': csv_paths if csv_paths is not None else b'',
+        'group2_files': [path.decode('utf-8') for path in group2_files],
+        'group2_dir': group2_dir.decode('utf-8') if group2_dir is not None else None,
+    }
+
+
+async def _aconnect() -> Optional['redis.asyncio.Redis']:
+    """
+    Создает асинхронный клиент Redis и проверяет соединение (см. _connect).
+    Вызывается под _async_init_lock. Возвращает None в случае ошибки.
+    """
+    global _async_redis_client, _async_init_failed, _async_last_init_attempt
+
+    if not CHAT_ID:
+        logger.error("Критическая ошибка: попытка использовать Redis, но CHAT_ID не установлен!")
+        return None
+    if _async_init_failed and time.monotonic() - _async_last_init_attempt < REDIS_RETRY_INTERVAL:
+        logger.debug("Redis недоступен (последняя попытка подключения не удалась), повтор позже.")
+        return None
+
+    import redis.asyncio
+
+    pool = redis.asyncio.BlockingConnectionPool(**_pool_options())
+    client = redis.asyncio.Redis(connection_pool=pool)
+    try:
+        await client.ping()
+    except redis.exceptions.ConnectionError as e:
+        logger.error("Не удалось подключиться к Redis: %s", e)
+        _async_init_failed = True
+        _async_last_init_attempt = time.monotonic()
+        await pool.disconnect()
+        return None
+
+    logger.info("Успешное подключение к Redis по адресу %s:%d (asyncio)", REDIS_HOST, REDIS_PORT)
+    _async_init_failed = False
+    _async_redis_client = client
+    return client
+
+
+async def get_async_redis_client() -> Optional['redis.asyncio.Redis']:
+    """
+    Асинхронный аналог get_redis_bytes_client (redis.asyncio, ответы как bytes).
+
+    Для вызывающих, которые уже работают в asyncio: ожидание ответов Redis не
+    блокирует поток, и в одном потоке может выполняться много запросов сразу.
+    Клиент и его пул создаются лениво и привязаны к циклу событий первого вызова,
+    поэтому закрыть их при завершении процесса (как close_redis через atexit)
+    нельзя: вызывающий должен выполнить `await aclose_redis()` в том же цикле
+    событий до его остановки.
+    """
+    if _async_redis_client is not None:
+        return _async_redis_client
+    # Проверка повторяется под блокировкой (см. get_redis_bytes_client)
+    async with _async_init_lock:
+        if _async_redis_client is None:
+            return await _aconnect()
+    return _async_redis_client
+
+
+async def aclose_redis():
+    """
+    Закрывает соединения асинхронного клиента Redis.
+
+    Вызывается владельцем цикла событий перед его остановкой (см. get_async_redis_client);
+    следующий get_async_redis_client() подключится заново.
+    """
+    global _async_redis_client
+
+    async with _async_init_lock:
+        if _async_redis_client is not None:
+            await _async_redis_client.connection_pool.disconnect()
+            _async_redis_client = None
+
+
+async def aprefetch_session(chat_id: str) -> Optional[Dict[str, Any]]:
+    """
+    Асинхронный аналог prefetch_session: все ключи сессии читаются одним конвейером.
+    """
+    client = await get_async_redis_client()
+    if not client:
+        return None
+
+    async with client.pipeline(transaction=False) as pipe:
+        _queue_session_reads(pipe, chat_id)
+        return _session_from_results(await pipe.execute())
+
+
+async def aget_group1_image_paths_with_indices(session: Optional[Dict[str, Any]] = None) -> List[tuple[int, str]]:
+    """
+    Асинхронный аналог get_group1_image_paths_with_indices.
+
+    Данные сессии читаются одним асинхронным конвейером, а кэш результата
+    записывается асинхронным клиентом. В отдельном потоке, не останавливая цикл
+    событий, выполняются только разбор CSV и проверка файлов (блокирующий
+    ввод-вывод, сама проверка идет в пуле потоков).
+
+    Args:
+        session (dict, optional): Результат aprefetch_session/prefetch_session.
+            Если не передан, читается из Redis.
+    """
+    if session is None:
+        session = await aprefetch_session(CHAT_ID)
+        if not session:
+            return []
+
+    csv_data = session['csv_raw']
     if not csv_data:
-        logger.error("Данные CSV не найдены в Redis по ключу '%s'", _REDIS_CSV_KEY)
+        logger.error("Данные CSV не найдены в Redis по ключу '%s'", f'{CHAT_ID}:csv:raw')
         return []
 
-    # Этот список будет хранить кортежи (индекс, путь)
-    indexed_paths = []
-    # Используем счетчик для создания уникального последовательного индекса
-    current_index = 0
-    
-    csv_file = io.StringIO(csv_data)
-    reader = csv.reader(csv_file, delimiter=CSV_CELL_DELIMITER)
+    # Значение кэша уже прочитано вместе с сессией (b'' — ключа нет), поэтому
+    # _load_cached_paths не обращается к Redis
+    paths_cache_key, csv_hash = _paths_cache_key(csv_data)
+    cached_paths = _load_cached_paths(paths_cache_key, csv_hash, session.get('csv_paths') or b'')
+    if cached_paths is not None:
+        logger.info("Пути Group 1 взяты из кэша Redis (ключ: '%s'): %d шт.", paths_cache_key, len(cached_paths))
+        return cached_paths
 
-    try:
+    indexed_paths = await asyncio.to_thread(_parse_group1_csv, csv_data)
+    if indexed_paths is None:
+        return []
+
+    client = await get_async_redis_client()
+    if client:
+        try:
+            await client.set(paths_cache_key, msgpack.packb([csv_hash, indexed_paths]), ex=CSV_PATHS_CACHE_TTL)
+        except redis.exceptions.RedisError as e:
+            logger.warning("Не удалось сохранить кэш путей Group 1 в Redis: %s", e)
+    return indexed_paths
+
+
+def decompress_csv_payload(payload: Optional[bytes]) -> Tuple[Optional[bytes], bool]:
+    """
+    Распаковывает CSV из Redis, если источник сохранил его сжатым gzip.
+
+    Формат определяется по сигнатуре, поэтому несжатый CSV читается как раньше.
+
+    Returns:
+        Кортеж (CSV в байтах или None, был ли он сжат).
+    """
+    if payload and payload[:2] == _GZIP_MAGIC:
+        return gzip.decompress(payload), True
+    return payload, False
+
+
+def compress_csv_payload(csv_text: str) -> bytes:
+    """
+    Сжимает CSV для записи в Redis (в том же формате, в каком его прислал источник).
+    """
+    return gzip.compress(csv_text.encode('utf-8'), compresslevel=_GZIP_LEVEL, mtime=0)
+
+
+def _join_image_cells(csv_data: bytes) -> Optional[str]:
+    """
+    Разбирает CSV и возвращает ячейки колонки изображений всех строк одной строкой,
+    склеенными через CSV_IMAGE_DELIMITER.
+
+    Нужна только одна колонка, поэтому, если в CSV нет кавычек (значит, нет
+    экранированных разделителей и переносов внутри ячеек), строки режутся
+    bytes.split только до нужной ячейки, а декодируется один раз уже склеенная
+    колонка. CSV с кавычками разбирается csv.reader.
+
+    Returns:
+        Склеенные ячейки или None, если колонки изображений нет в заголовке.
+        StopIteration — если в CSV нет даже заголовка.
+    """
+    if b'"' in csv_data:
+        # CSV декодируется из байтов по частям прямо при разборе (без копии в виде str)
+        csv_file = io.TextIOWrapper(io.BytesIO(csv_data), encoding='utf-8', newline='')
+        reader = csv.reader(csv_file, delimiter=CSV_CELL_DELIMITER)
         headers = next(reader)
         if CSV_IMAGE_COLUMN not in headers:
-            logger.error("В CSV отсутствует обязательная колонка: '%s'", CSV_IMAGE_COLUMN)
-            return []
-        
+            return None
         image_col_index = headers.index(CSV_IMAGE_COLUMN)
+        return CSV_IMAGE_DELIMITER.join(row[image_col_index] for row in reader
+                                        if len(row) > image_col_index)
+
+    header_line, _, body = csv_data.partition(b'\n')
+    headers = header_line.decode('utf-8').rstrip('\r').split(CSV_CELL_DELIMITER)
+    if CSV_IMAGE_COLUMN not in headers:
+        return None
+    col = headers.index(CSV_IMAGE_COLUMN)
+
+    # Все, что нужно в цикле, — локальные переменные (без поиска в глобальных)
+    delimiter = CSV_CELL_DELIMITER.encode('utf-8')
+    maxsplit = col + 1
+    rows = [line.split(delimiter, maxsplit) for line in body.rstrip(b'\r\n').split(b'\n')]
+    try:
+        # Обычно все строки полные: ячейки выбирает itemgetter без проверки длины каждой строки
+        cells = list(map(itemgetter(col), rows))
+    except IndexError:
+        # Есть короткие (или пустые) строки — выбираем ячейки с проверкой длины
+        cells = [parts[col] for parts in rows if len(parts) > col]
+    return CSV_IMAGE_DELIMITER.encode('utf-8').join(cells).decode('utf-8')
+
+
+def _paths_cache_key(csv_data: bytes) -> Tuple[str, str]:
+    """
+    Возвращает ключ кэша результата разбора CSV и хэш CSV, с которым он сверяется.
+    """
+    return f'{CHAT_ID}:csv:paths', hashlib.blake2b(csv_data, digest_size=8).hexdigest()
+
+
+def _load_cached_paths(cache_key: str, csv_hash: str,
+                       packed: Optional[bytes] = None) -> Optional[List[tuple[int, str]]]:
+    """
+    Возвращает сохраненный в Redis результат разбора CSV, если он получен из
+    того же CSV (совпадает хэш). None — если результата нет или он устарел.
+
+    packed — значение ключа, уже прочитанное из Redis (b'' — ключа нет);
+    если не передано, читается отдельным запросом.
+    """
+    try:
+        if packed is None:
+            client = get_redis_bytes_client()
+            if not client:
+                return None
+            packed = client.get(cache_key)
+        if not packed:
+            return None
+        cached_hash, indexed_paths = msgpack.unpackb(packed)
+        if cached_hash != csv_hash:
+            return None
+        return [(index, path) for index, path in indexed_paths]
+    except (redis.exceptions.RedisError, ValueError, TypeError) as e:
+        logger.warning("Не удалось прочитать кэш путей Group 1 из Redis: %s", e)
+        return None
 
-        for row in reader:
-            if len(row) > image_col_index and row[image_col_index]:
-                # Разделяем пути внутри одной ячейки
-                paths_in_cell = row[image_col_index].split(CSV_IMAGE_DELIMITER)
-                
-                for path in paths_in_cell:
-                    clean_path = path.strip()
-                    # Проверяем, что путь не пустой и файл валидный
-                    if clean_path and validate_image_file(clean_path):
-                        # КЛЮЧЕВОЙ МОМЕНТ: добавляем кортеж с текущим индексом и путем
-                        indexed_paths.append((current_index, clean_path))
-                        # Увеличиваем индекс для следующего изображения
-                        current_index += 1
-                    elif clean_path:
-                        logger.warning("Пропущен невалидный путь к файлу: %s", clean_path)
+
+def _store_cached_paths(cache_key: str, csv_hash: str, indexed_paths: List[tuple[int, str]]):
+    """
+    Сохраняет результат разбора CSV вместе с хэшем CSV в Redis на CSV_PATHS_CACHE_TTL секунд.
+    """
+    client = get_redis_bytes_client()
+    if not client:
+        return
+    try:
+        client.set(cache_key, msgpack.packb([csv_hash, indexed_paths]), ex=CSV_PATHS_CACHE_TTL)
+    except redis.exceptions.RedisError as e:
+        logger.warning("Не удалось сохранить кэш путей Group 1 в Redis: %s", e)
+
+
+def _parse_group1_csv(csv_data: bytes) -> Optional[List[tuple[int, str]]]:
+    """
+    Разбирает CSV и проверяет файлы: возвращает список кортежей (индекс, путь)
+    для валидных изображений в исходном порядке.
+
+    Работает только с данными и файлами, без обращений к Redis, поэтому
+    асинхронный вариант выполняет ее в отдельном потоке.
+
+    Returns:
+        Список (индекс, путь) или None, если CSV разобрать не удалось
+        (такой результат не кэшируется).
+    """
+    # Все пути из CSV в исходном порядке; проверяются потом одной пачкой
+    candidate_paths = []
+
+    try:
+        image_cells = _join_image_cells(csv_data)
+        if image_cells is None:
+            logger.error("В CSV отсутствует обязательная колонка: '%s'", CSV_IMAGE_COLUMN)
+            return None
+
+        # Ячейки склеены через тот же разделитель, поэтому пути всех строк выделяются
+        # одним вызовом findall — без промежуточного списка на каждую строку
+        # (пробелы вокруг путей и пустые пути отбрасываются)
+        candidate_paths = _IMAGE_PATH_RE.findall(image_cells)
 
     except StopIteration:
         logger.warning("CSV файл в Redis пуст (содержит только заголовки или ничего).")
     except Exception as e:
         logger.error("Ошибка при парсинге CSV из Redis: %s", e)
-        return []
+        return None
+
+    # Файлы проверяются параллельно в пуле потоков (задержки диска перекрываются).
+    # Один путь может встречаться в CSV несколько раз — каждый файл проверяется
+    # один раз, а результат применяется ко всем его вхождениям
+    unique_paths = list(dict.fromkeys(candidate_paths))
+    is_valid_path = dict(zip(unique_paths, validate_image_files(unique_paths, deep=True)))
+
+    valid_paths = []
+    append_valid = valid_paths.append
+    for clean_path in candidate_paths:
+        if is_valid_path[clean_path]:
+            append_valid(clean_path)
+        else:
+            logger.warning("Пропущен невалидный путь к файлу: %s", clean_path)
+
+    # КЛЮЧЕВОЙ МОМЕНТ: кортежи (индекс, путь), индекс — порядковый номер среди валидных изображений
+    indexed_paths = list(enumerate(valid_paths))
 
     logger.info("Извлечено и проиндексировано %d валидных путей изображений из CSV для Group 1.", len(indexed_paths))
-    
+
     return indexed_paths
 
 
-def get_group2_dir_paths() -> str|None:
+def get_group1_image_paths_with_indices(csv_data: Optional[bytes] = None,
+                                        paths_cache: Optional[bytes] = None) -> List[tuple[int, str]]:
+    """
+    Извлекает CSV из Redis, парсит его и возвращает список кортежей
+    (индекс, путь) для изображений Group 1, сохраняя их исходный порядок.
+
+    Args:
+        csv_data (bytes, optional): CSV, уже прочитанный из Redis (см. prefetch_session).
+            Если не передан, читается по ключу {CHAT_ID}:csv:raw.
+        paths_cache (bytes, optional): Значение ключа {CHAT_ID}:csv:paths, уже
+            прочитанное из Redis (b'' — ключа нет). Если не передано, читается из Redis.
+    """
+    _REDIS_CSV_KEY = f'{CHAT_ID}:csv:raw'
+    if csv_data is None:
+        client = get_redis_bytes_client()
+        if not client:
+            return []  # Не удалось получить клиент, возвращаем пустой список
+
+        logger.info("Получение CSV для Group 1 из Redis (ключ: '%s')", _REDIS_CSV_KEY)
+        csv_data, _ = decompress_csv_payload(client.get(_REDIS_CSV_KEY))
+
+    if not csv_data:
+        logger.error("Данные CSV не найдены в Redis по ключу '%s'", _REDIS_CSV_KEY)
+        return []
+
+    # Результат разбора и валидации хранится в Redis вместе с хэшем CSV: пока CSV
+    # не изменился, разбирать его не нужно. Ключ постоянный, поэтому обычно он
+    # читается тем же конвейером, что и сам CSV (см. prefetch_session)
+    paths_cache_key, csv_hash = _paths_cache_key(csv_data)
+    cached_paths = _load_cached_paths(paths_cache_key, csv_hash, paths_cache)
+    if cached_paths is not None:
+        logger.info("Пути Group 1 взяты из кэша Redis (ключ: '%s'): %d шт.", paths_cache_key, len(cached_paths))
+        return cached_paths
+
+    indexed_paths = _parse_group1_csv(csv_data)
+    if indexed_paths is None:
+        return []
+
+    _store_cached_paths(paths_cache_key, csv_hash, indexed_paths)
+    return indexed_paths
+
+
+def get_group2_file_paths(file_paths: Optional[List[str]] = None) -> List[str]:
+    """
+    Получает готовый список файлов Group 2 из Redis (список {CHAT_ID}:GROUP2_FILES).
+
+    Если источник данных уже знает файлы базы, он кладет их в этот список, и
+    сканировать директорию не нужно: весь список читается одним LRANGE.
+
+    Args:
+        file_paths (List[str], optional): Список, уже прочитанный из Redis
+            (см. prefetch_session). Если не передан, читается из Redis.
+
+    Returns:
+        Список путей (пустой, если списка в Redis нет).
+    """
+    _REDIS_GROUP2_FILES_KEY = f'{CHAT_ID}:GROUP2_FILES'
+    if file_paths is None:
+        client = get_redis_bytes_client()
+        if not client:
+            return []
+
+        logger.info("Получение списка файлов Group 2 из Redis (ключ: '%s')", _REDIS_GROUP2_FILES_KEY)
+        file_paths = [path.decode('utf-8') for path in client.lrange(_REDIS_GROUP2_FILES_KEY, 0, -1)]
+
+    if file_paths:
+        logger.info("Список файлов Group 2 из Redis получен: %d шт.", len(file_paths))
+    return file_paths
+
+
+def get_group2_dir_paths(directory_path: Optional[str] = None) -> str|None:
     """
     Получает ПУТЬ к директории из Redis, а затем сканирует ее
     с помощью общей функции `collect_from_dir`.
-    """
-    client = get_redis_client()
-    if not client:
-        return None
 
+    Args:
+        directory_path (str, optional): Путь, уже прочитанный из Redis
+            (см. prefetch_session). Если не передан, читается из Redis.
+    """
     # Предполагаем, что в Redis по этому ключу лежит ОДИН путь к директории
     _REDIS_GROUP2_KEY = f'{CHAT_ID}:GROUP2_DIR_IMAGES' 
-    logger.info("Получение пути к директории для Group 2 из Redis (ключ: '%s')", _REDIS_GROUP2_KEY)
-    
-    directory_path = client.get(_REDIS_GROUP2_KEY)
+    if directory_path is None:
+        client = get_redis_bytes_client()
+        if not client:
+            return None
+
+        logger.info("Получение пути к директории для Group 2 из Redis (ключ: '%s')", _REDIS_GROUP2_KEY)
+        raw_path = client.get(_REDIS_GROUP2_KEY)
+        directory_path = raw_path.decode('utf-8') if raw_path is not None else None
 
     if not directory_path:
         logger.error("Путь к директории не найден в Redis по ключу '%s'", _REDIS_GROUP2_KEY)
@@ -3,6 +3,10 @@
 Конфигурация для поиска изображений на основе кэширования дескрипторов
 и геометрической верификации (RANSAC).
 """
+import os
+import socket
+from typing import Final, Optional
+
 # --- ПУТИ К ДАННЫМ ---
 GROUP_1_DIR = r"C:\Programming\Work_project\CIAN_general_parser\Project\images\watermark_test"
 
@@ -10,14 +14,43 @@ GROUP_1_DIR = r"C:\Programming\Work_project\CIAN_general_parser\Project\images\w
 GROUP_2_DIR = r"C:\Programming\Work_project\CIAN_general_parser\Project\images\save"
 
 OUTPUT_DIR = r"/app/data/presentation/replaced_images"
+# Идентификатор сессии (переменная окружения CHAT_ID): имя поддиректории
+# в OUTPUT_DIR и префикс ключей Redis. None, если переменная не установлена.
+CHAT_ID: Optional[str] = os.getenv('CHAT_ID')
+# Если True, файлы результата в OUTPUT_DIR создаются жесткими ссылками на исходные
+# изображения Group 1/Group 2 (без копирования данных). Такой файл — тот же файл,
+# что и исходный: его изменение на месте меняет и исходное изображение в базе.
+# Если потребитель результата редактирует файлы, установите False — они будут копироваться.
+OUTPUT_USE_HARDLINKS = True
 
 # Теперь мы храним не индекс, а просто кэш дескрипторов
-DESCRIPTORS_CACHE_PATH = "descriptors_cache.pkl"
+DESCRIPTORS_CACHE_PATH = "descriptors_cache.msgpack"
+
+# Кэш результатов проверки целостности изображений (SQLite)
+VALIDATION_CACHE_PATH = "validation_cache.sqlite"
+# Количество потоков для параллельной валидации файлов (задача упирается в ввод-вывод,
+# поэтому потоков больше, чем ядер)
+VALIDATION_WORKERS = min(32, (os.cpu_count() or 1) * 4)
 
 # --- ТЕХНИЧЕСКИЕ ПАРАМЕТРЫ ---
 RESIZE_WIDTH = 800
 RESIZE_HEIGHT = 800
 ORB_N_FEATURES = 2000
+# Параметры детектора ORB: меньше уровней пирамиды и порог FAST выше стандартного
+# дают меньше избыточных ключевых точек, что ускоряет и поиск, и RANSAC.
+ORB_N_LEVELS = 4
+ORB_EDGE_THRESHOLD = 15
+ORB_FAST_THRESHOLD = 20
+
+# Число потоков OpenMP для поиска в индексе FAISS (переменная окружения FAISS_THREADS).
+# Извлечение признаков в процессах-воркерах FAISS не использует и работает в один поток.
+FAISS_THREADS = int(os.getenv('FAISS_THREADS', os.cpu_count() or 1))
+
+# Для больших баз вместо полного перебора строится инвертированный индекс
+# IndexBinaryIVF (приближенный поиск): ~sqrt(N) кластеров, при поиске
+# просматриваются только FAISS_IVF_NPROBE ближайших из них.
+FAISS_IVF_MIN_DESCRIPTORS = 1_000_000
+FAISS_IVF_NPROBE = 16
 
 # Параметры поиска и верификации
 # Минимальное количество "хороших" совпадений для рассмотрения кандидата
@@ -29,13 +62,34 @@ RANSAC_MIN_INLIERS = 100
 REDIS_HOST = "redis"
 REDIS_PORT = 6379
 REDIS_DB = 0
+# Максимум одновременных соединений в пуле; при исчерпании клиент ждет свободное
+REDIS_MAX_CONNECTIONS = 32
+# Сколько секунд после неудачного подключения к Redis не пытаться подключиться снова
+REDIS_RETRY_INTERVAL = 30
+# TCP keepalive для соединений пула: соединение, простаивающее за NAT или
+# балансировщиком, не «умирает» незаметно. Параметры TCP_KEEP* есть не на всех
+# платформах, поэтому задаются только доступные.
+REDIS_SOCKET_KEEPALIVE = True
+REDIS_SOCKET_KEEPALIVE_OPTIONS = {
+    option: value
+    for option, value in (
+        (getattr(socket, 'TCP_KEEPIDLE', None), 30),
+        (getattr(socket, 'TCP_KEEPINTVL', None), 10),
+        (getattr(socket, 'TCP_KEEPCNT', None), 3),
+    )
+    if option is not None
+}
+# Соединение, простаивавшее дольше этого числа секунд, перед командой проверяется PING
+REDIS_HEALTH_CHECK_INTERVAL = 15
 REDIS_TEMP_CSV_PATH ="/app/temp.csv"
 
 
-# Параметры парсинга CSV из Redis
-CSV_IMAGE_COLUMN = "Ссылки на изображения"
-CSV_CELL_DELIMITER = "|"
-CSV_IMAGE_DELIMITER = ";"
+# Параметры парсинга CSV из Redis (неизменяемые: модули копируют их к себе при импорте)
+CSV_IMAGE_COLUMN: Final[str] = "Ссылки на изображения"
+CSV_CELL_DELIMITER: Final[str] = "|"
+CSV_IMAGE_DELIMITER: Final[str] = ";"
+# Сколько секунд Redis хранит результат разбора и валидации CSV (ключ {CHAT_ID}:csv:paths)
+CSV_PATHS_CACHE_TTL = 3600
 
 
 # --- ЛОГИКА ОБРАБОТКИ РЕЗУЛЬТАТОВ ---